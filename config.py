@@ -16,6 +16,36 @@ class Config(object):
         'appmeta':      'sqlite:////{}/appmeta.db'.format(CORPUS_FOLDERS[0])
     }
     CACHE_DIRECTORY = os.environ.get('NEMO_CACHE_DIR') or './cache/'
+    # The parsed corpus inventory is saved here and only re-parsed when the corpus has changed
+    SNAPSHOT_DIRECTORY = os.environ.get('NEMO_SNAPSHOT_DIR') or os.path.join(CACHE_DIRECTORY, 'snapshots')
+    # Maximum number of entries in the in-memory and on-disk tiers of the resolver cache and their eviction policy
+    RESOLVER_CACHE_MEMORY_ITEMS = int(os.environ.get('RESOLVER_CACHE_MEMORY_ITEMS') or 2000)
+    RESOLVER_CACHE_DISK_ITEMS = int(os.environ.get('RESOLVER_CACHE_DISK_ITEMS') or 20000)
+    RESOLVER_CACHE_POLICY = os.environ.get('RESOLVER_CACHE_POLICY') or 'lru'
+    # Number of processes used to read the TEI files when the corpus has to be parsed
+    CORPUS_PARSE_WORKERS = int(os.environ.get('CORPUS_PARSE_WORKERS') or 1)
+    # Maximum number and estimated memory in bytes of the parsed TEI texts kept by each worker (0 means no limit)
+    TEXT_CACHE_ITEMS = int(os.environ.get('TEXT_CACHE_ITEMS') or 100)
+    TEXT_CACHE_BYTES = int(os.environ.get('TEXT_CACHE_BYTES') or 256 * 1024 * 1024)
+    # Maximum number of rendered passages kept in memory and on disk by each worker (0 on disk means no disk tier)
+    PASSAGE_CACHE_MEMORY_ITEMS = int(os.environ.get('PASSAGE_CACHE_MEMORY_ITEMS') or 1000)
+    PASSAGE_CACHE_DISK_ITEMS = int(os.environ.get('PASSAGE_CACHE_DISK_ITEMS') or 10000)
+    # Maximum number of texts whose sibling tables (the previous and next passages) are kept in memory by each worker
+    SIBLING_TABLE_ITEMS = int(os.environ.get('SIBLING_TABLE_ITEMS') or 1000)
+    # Passages rendered ahead of time by the prerender manager command, served instead of rendering them on request
+    FRAGMENT_DIRECTORY = os.environ.get('NEMO_FRAGMENT_DIR') or os.path.join(CACHE_DIRECTORY, 'fragments')
+    # The templates compiled by the precompile manager command, which the workers load instead of compiling them
+    TEMPLATE_CACHE_DIRECTORY = os.environ.get('NEMO_TEMPLATE_CACHE_DIR') or os.path.join(CACHE_DIRECTORY, 'templates')
+    # Maximum number of rendered template fragments (the {% cache %} blocks) kept in memory by each worker
+    FRAGMENT_CACHE_ITEMS = int(os.environ.get('FRAGMENT_CACHE_ITEMS') or 1000)
+    # Number of threads that retrieve and transform the passages of the texts shown side by side
+    PASSAGE_WORKERS = int(os.environ.get('PASSAGE_WORKERS') or 4)
+    # Whether the passages before and after an NT passage and their commentary sections are rendered in the background
+    PREFETCH_COMMENTARIES = os.environ.get('PREFETCH_COMMENTARIES') is not None
+    # Seconds between two checks of the corpus folders for changes (0 means only reload on the reload manager command)
+    CORPUS_RELOAD_INTERVAL = int(os.environ.get('CORPUS_RELOAD_INTERVAL') or 0)
+    # Seconds between two checks of an XSL stylesheet for changes by each thread (0 means before every transformation)
+    XSLT_CHECK_INTERVAL = int(os.environ.get('XSLT_CHECK_INTERVAL') or 60)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
@@ -24,4 +54,9 @@ class Config(object):
     ADMINS = os.environ.get('ADMINS').split(';') if os.environ.get('ADMINS') else ['no-reply@example.com']
     # This should only be changed to True when collecting search queries and responses for mocking ES
     SAVE_REQUESTS = False
+    # Seconds the shared cache (Varnish) keeps the corpus pages, which are purged when their texts are reloaded
     CACHE_MAX_AGE = os.environ.get('VARNISH_MAX_AGE') or 0 # This doesn't need to be set locally.
+    # Seconds browsers reuse the corpus pages before they revalidate them
+    CACHE_BROWSER_MAX_AGE = int(os.environ.get('BROWSER_MAX_AGE') or 0)
+    # The URL to which PURGE requests with the surrogate keys of reloaded texts are sent (None means no purging)
+    CACHE_PURGE_URL = os.environ.get('VARNISH_PURGE_URL')
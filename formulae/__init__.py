@@ -11,6 +11,7 @@ from flask_bootstrap import Bootstrap
 from flask_babel import Babel
 from flask_babel import lazy_gettext as _l
 from flask_mail import Mail
+from .startup import StartupReport
 
 db = SQLAlchemy()
 login = LoginManager()
@@ -22,22 +23,27 @@ babel = Babel()
 mail = Mail()
 
 
-def create_app(config_class=Config):
-    app = Flask("Flask Application for Nemo")
-    app.config.from_object(config_class)
-    app.elasticsearch = Elasticsearch(app.config['ELASTICSEARCH_URL']) \
-        if app.config['ELASTICSEARCH_URL'] else None
+def create_app(config_class=Config, startup_report=None):
+    report = startup_report or StartupReport()
+    with report.phase('flask'):
+        app = Flask("Flask Application for Nemo")
+        app.config.from_object(config_class)
+        app.elasticsearch = Elasticsearch(app.config['ELASTICSEARCH_URL']) \
+            if app.config['ELASTICSEARCH_URL'] else None
 
-    db.init_app(app)
-    migrate.init_app(app, db)
-    login.init_app(app)
-    mail.init_app(app)
-    bootstrap.init_app(app)
-    babel.init_app(app)
-    from .auth import bp as auth_bp
-    app.register_blueprint(auth_bp, url_prefix="/auth")
-    from .search import bp as search_bp
-    app.register_blueprint(search_bp, url_prefix="/search")
+    with report.phase('sqlalchemy'):
+        db.init_app(app)
+        migrate.init_app(app, db)
+    with report.phase('extensions'):
+        login.init_app(app)
+        mail.init_app(app)
+        bootstrap.init_app(app)
+        babel.init_app(app)
+    with report.phase('blueprints'):
+        from .auth import bp as auth_bp
+        app.register_blueprint(auth_bp, url_prefix="/auth")
+        from .search import bp as search_bp
+        app.register_blueprint(search_bp, url_prefix="/search")
 
     if not app.debug and not app.testing:
         if not os.path.exists('logs'):
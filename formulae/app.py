@@ -1,15 +1,29 @@
-from werkzeug.contrib.cache import FileSystemCache
-from capitains_nautilus.cts.resolver import NautilusCTSResolver
 from capitains_nautilus.flask_ext import FlaskNautilus
 from . import create_app
 from .nemo import NemoFormulae
 from .dispatcher_builder import organizer
+from .resolver import FormulaeCTSResolver
+from .cache import TwoTierCache
+from .prerender import FragmentStore
+from .startup import StartupReport
 
-flask_app = create_app()
-resolver = NautilusCTSResolver(flask_app.config['CORPUS_FOLDERS'],
-                               dispatcher=organizer,
-                               # cache=FileSystemCache(flask_app.config['CACHE_DIRECTORY'])
-                               )
+startup_report = StartupReport()
+with startup_report.phase('create_app'):
+    flask_app = create_app(startup_report=startup_report)
+with startup_report.phase('resolver'):
+    resolver = FormulaeCTSResolver(flask_app.config['CORPUS_FOLDERS'],
+                                   dispatcher=organizer,
+                                   snapshot_folder=flask_app.config['SNAPSHOT_DIRECTORY'],
+                                   workers=flask_app.config['CORPUS_PARSE_WORKERS'],
+                                   text_cache_items=flask_app.config['TEXT_CACHE_ITEMS'],
+                                   text_cache_bytes=flask_app.config['TEXT_CACHE_BYTES'],
+                                   cache=TwoTierCache(flask_app.config['CACHE_DIRECTORY'],
+                                                      memory_items=flask_app.config['RESOLVER_CACHE_MEMORY_ITEMS'],
+                                                      disk_items=flask_app.config['RESOLVER_CACHE_DISK_ITEMS'],
+                                                      policy=flask_app.config['RESOLVER_CACHE_POLICY'])
+                                   )
+    with startup_report.phase('inventory'):
+        resolver.getMetadata()
 # nautilus_api = FlaskNautilus(prefix="/api", resolver=resolver, app=flask_app)
 
 nemo = NemoFormulae(
@@ -26,7 +40,22 @@ nemo = NemoFormulae(
                "errors": "templates/errors",
                "auth": "templates/auth",
                "search": "templates/search"},
-    pdf_folder="pdf_folder/"
+    pdf_folder="pdf_folder/",
+    passage_cache=TwoTierCache(flask_app.config['CACHE_DIRECTORY'],
+                               namespace=resolver.corpus_version,
+                               memory_items=flask_app.config['PASSAGE_CACHE_MEMORY_ITEMS'],
+                               disk_items=flask_app.config['PASSAGE_CACHE_DISK_ITEMS'] or None,
+                               policy=flask_app.config['RESOLVER_CACHE_POLICY'],
+                               prefix='passages-'),
+    fragments=FragmentStore(flask_app.config['FRAGMENT_DIRECTORY']),
+    fragment_cache_items=flask_app.config['FRAGMENT_CACHE_ITEMS'],
+    template_cache_folder=flask_app.config['TEMPLATE_CACHE_DIRECTORY'],
+    passage_workers=flask_app.config['PASSAGE_WORKERS'],
+    prefetch_commentaries=flask_app.config['PREFETCH_COMMENTARIES'],
+    xslt_check_interval=flask_app.config['XSLT_CHECK_INTERVAL'],
+    sibling_table_items=flask_app.config['SIBLING_TABLE_ITEMS'],
+    startup_report=startup_report
 )
+startup_report.log(flask_app.logger)
 
 
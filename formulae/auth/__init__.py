@@ -1,5 +1,15 @@
 from flask import Blueprint
+from formulae.cache import CachePolicy
 
 bp = Blueprint('auth', __name__)
+# The pages of the user account must never be kept by any cache (see NemoFormulae.after_request)
+bp.cache_policies = {
+    "r_login": CachePolicy(no_store=True),
+    "r_logout": CachePolicy(no_store=True),
+    "r_user": CachePolicy(no_store=True),
+    "r_reset_password_request": CachePolicy(no_store=True),
+    "r_reset_password": CachePolicy(no_store=True),
+    "r_register": CachePolicy(no_store=True)
+}
 
 from formulae.auth import routes
@@ -0,0 +1,370 @@
+from werkzeug.contrib.cache import BaseCache, FileSystemCache
+from collections import OrderedDict
+from threading import RLock
+from time import time
+from urllib.request import Request, urlopen
+import logging
+import os
+import shutil
+
+
+class BoundedMemoryCache(BaseCache):
+    """ Thread-safe in-process cache holding at most max_items entries (and, if given, at most max_size units as
+    measured by sizeof)
+
+    :param max_items: The maximum number of entries. 0 means no limit.
+    :type max_items: int
+    :param max_size: The maximum total size of the entries. 0 means no limit.
+    :type max_size: int
+    :param sizeof: Function returning the size of a value. Only used when max_size is set.
+    :type sizeof: function
+    :param policy: The eviction policy: 'lru' evicts the least recently used entry, 'fifo' the oldest one
+    :type policy: str
+    :param default_timeout: The default timeout in seconds. 0 means that entries do not expire.
+    :type default_timeout: int
+    """
+    POLICIES = ('lru', 'fifo')
+
+    def __init__(self, max_items=1000, max_size=0, sizeof=None, policy='lru', default_timeout=0):
+        BaseCache.__init__(self, default_timeout)
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown eviction policy {}. Choose one of {}.'.format(policy, ', '.join(self.POLICIES)))
+        self.max_items = max_items
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.policy = policy
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _normalize_timeout(self, timeout):
+        timeout = BaseCache._normalize_timeout(self, timeout)
+        if timeout > 0:
+            timeout = time() + timeout
+        return timeout
+
+    def _pop(self, key):
+        expires, size, value = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def _evict(self):
+        while self._entries and ((self.max_items and len(self._entries) > self.max_items) or
+                                 (self.max_size and self.size > self.max_size)):
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, size, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires != 0 and expires <= time():
+                self._pop(key)
+                self.misses += 1
+                return None
+            if self.policy == 'lru':
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        size = self.sizeof(value) if self.max_size else 1
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (self._normalize_timeout(timeout), size, value)
+            self.size += size
+            self._evict()
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self.has(key):
+                return False
+            return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+                return True
+            return False
+
+    def has(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            expires = self._entries[key][0]
+            return expires == 0 or expires > time()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        return True
+
+
+class BoundedFileSystemCache(FileSystemCache):
+    """ FileSystemCache that, once it holds more than threshold entries, evicts the least recently used ('lru') or
+    the oldest ('fifo') entries instead of an arbitrary third of them
+
+    :param cache_dir: The directory where cache files are stored.
+    :type cache_dir: str
+    :param threshold: The maximum number of files. 0 means no limit.
+    :type threshold: int
+    :param policy: The eviction policy
+    :type policy: str
+    """
+    def __init__(self, cache_dir, threshold=10000, policy='lru', **kwargs):
+        if policy not in BoundedMemoryCache.POLICIES:
+            raise ValueError('Unknown eviction policy {}. Choose one of {}.'.format(
+                policy, ', '.join(BoundedMemoryCache.POLICIES)))
+        self.policy = policy
+        super(BoundedFileSystemCache, self).__init__(cache_dir, threshold=threshold, default_timeout=0, **kwargs)
+
+    def _prune(self):
+        if self._threshold == 0 or not self._file_count > self._threshold:
+            return
+        entries = []
+        for fname in self._list_dir():
+            try:
+                entries.append((os.path.getmtime(fname), fname))
+            except OSError:
+                pass
+        # Prune down to 90% of the threshold so that not every new entry triggers another pruning
+        for mtime, fname in sorted(entries)[:max(len(entries) - int(self._threshold * 0.9), 0)]:
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+        self._update_count(value=len(self._list_dir()))
+
+    def get(self, key):
+        value = super(BoundedFileSystemCache, self).get(key)
+        if value is not None and self.policy == 'lru':
+            try:
+                os.utime(self._get_filename(key))
+            except OSError:
+                pass
+        return value
+
+
+class TwoTierCache(BaseCache):
+    """ Cache with a bounded in-process tier in front of a bounded disk tier, e.g. for the resolver
+
+    Entries are kept in a sub-folder of cache_dir named after the prefix and the namespace, which should be the corpus
+    version. Entries cached for another version of the corpus can thus never be served. Their folders are left to the
+    workers that still use them, e.g. during a rolling restart, until they are removed by prune.
+
+    :param cache_dir: The folder in which the disk tier is kept (i.e., CACHE_DIRECTORY)
+    :type cache_dir: str
+    :param namespace: The namespace of the cache entries. There is no disk tier until a namespace is set.
+    :type namespace: str
+    :param memory_items: The maximum number of entries in the memory tier
+    :type memory_items: int
+    :param disk_items: The maximum number of entries in the disk tier. If None, there is no disk tier.
+    :type disk_items: int
+    :param policy: The eviction policy of both tiers ('lru' or 'fifo')
+    :type policy: str
+    :param prefix: The prefix of the sub-folders of this cache, which must differ between the caches sharing cache_dir
+    :type prefix: str
+
+    :ivar hits: Number of get calls answered by either tier
+    :ivar misses: Number of get calls answered by neither tier
+    """
+    NAMESPACE_PREFIX = 'resolver-'
+
+    def __init__(self, cache_dir, namespace=None, memory_items=1000, disk_items=10000, policy='lru', prefix=None):
+        BaseCache.__init__(self, default_timeout=0)
+        self.cache_dir = cache_dir
+        self.prefix = prefix or self.NAMESPACE_PREFIX
+        self.hits = 0
+        self.misses = 0
+        self.disk_items = disk_items
+        self.policy = policy
+        self.logger = logging.getLogger(__name__)
+        self.memory = BoundedMemoryCache(max_items=memory_items, policy=policy)
+        self.disk = None
+        self.namespace = namespace
+
+    @property
+    def namespace(self):
+        """ The namespace of the cache entries. Setting it drops the entries of the memory tier.
+
+        :rtype: str
+        """
+        return self.__namespace__
+
+    @namespace.setter
+    def namespace(self, value):
+        self.__namespace__ = value
+        self.memory.clear()
+        if self.disk_items is None or value is None:
+            self.disk = None
+            return
+        self.disk = BoundedFileSystemCache(os.path.join(self.cache_dir, self.prefix + value), threshold=self.disk_items,
+                                           policy=self.policy)
+
+    def prune(self, max_age=0):
+        """ Remove the folders of the other namespaces of this cache that have not been used for max_age seconds, e.g.
+        those of older corpus versions once no worker serves them any more
+
+        :param max_age: The seconds since the last entry of a folder was written or, with the 'lru' policy, read
+        :type max_age: int
+        :return: The removed folders
+        :rtype: [str]
+        """
+        removed = []
+        if not os.path.isdir(self.cache_dir):
+            return removed
+        current = self.prefix + self.namespace if self.namespace is not None else None
+        oldest = time() - max_age
+        for folder in sorted(os.listdir(self.cache_dir)):
+            path = os.path.join(self.cache_dir, folder)
+            if not folder.startswith(self.prefix) or folder == current or not os.path.isdir(path):
+                continue
+            try:
+                last_used = max([os.path.getmtime(path)] + [entry.stat().st_mtime for entry in os.scandir(path)])
+            except OSError:
+                continue
+            if last_used <= oldest:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(folder)
+        return removed
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except Exception as E:
+                # Entries pickled by another version of the libraries may not be readable any more
+                self.logger.warning('%s could not be read from the disk cache: %s', key, E)
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.memory.set(key, value, timeout)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, timeout)
+            except Exception as E:
+                # Values that cannot be pickled are only kept in memory
+                self.logger.warning('%s could not be cached on disk: %s', key, E)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        deleted = self.memory.delete(key)
+        if self.disk is not None:
+            deleted = self.disk.delete(key) or deleted
+        return deleted
+
+    def has(self, key):
+        return self.memory.has(key) or (self.disk is not None and self.disk.has(key))
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            return self.disk.clear()
+        return True
+
+
+class CachePolicy(object):
+    """ How the responses of a route may be cached by the browsers and by the shared cache (Varnish) in front of the app
+
+    The ages are given in seconds or as the name of the setting that holds them.
+
+    :param max_age: How long browsers may reuse a response
+    :type max_age: int or str
+    :param s_maxage: How long the shared cache may keep a response. None means that only the browser of the user may
+        keep it.
+    :type s_maxage: int or str
+    :param vary: The request headers that the response depends on, e.g. Cookie, which holds the locale of the session.
+        Only the shared responses that vary on Cookie are checked for flashed messages and logged-in users.
+    :type vary: (str)
+    :param no_store: Whether the response must not be kept at all, e.g. because it contains personal data
+    :type no_store: bool
+    """
+    __slots__ = ('max_age', 's_maxage', 'vary', 'no_store')
+
+    def __init__(self, max_age=0, s_maxage=None, vary=(), no_store=False):
+        self.max_age = max_age
+        self.s_maxage = s_maxage
+        self.vary = tuple(vary)
+        self.no_store = no_store
+
+    @property
+    def shared(self):
+        """ Whether the shared cache may keep the responses
+
+        :rtype: bool
+        """
+        return self.s_maxage is not None and not self.no_store
+
+    @staticmethod
+    def seconds(age, config):
+        """ The seconds of an age given as a number or as the name of a setting"""
+        return int(config.get(age) or 0) if isinstance(age, str) else age
+
+    def apply(self, response, config, private=False):
+        """ Set the Cache-Control and Vary headers of a response
+
+        :param response: The response
+        :type response: flask.Response
+        :param config: The settings of the app
+        :type config: dict
+        :param private: Whether this response is personal although the route is shared, e.g. a page with a flashed
+            message or the page of a logged-in user
+        :type private: bool
+        """
+        for header in self.vary:
+            response.vary.add(header)
+        if self.no_store:
+            response.cache_control.no_store = True
+            response.cache_control.private = True
+            return
+        response.cache_control.max_age = self.seconds(self.max_age, config)
+        if self.shared and not private:
+            response.cache_control.public = True
+            response.cache_control.s_maxage = self.seconds(self.s_maxage, config)
+        else:
+            response.cache_control.private = True
+
+
+def purge_surrogate_keys(url, keys, timeout=5):
+    """ Ask the shared cache in front of the app to drop the responses tagged with any of the surrogate keys
+
+    The keys are sent space-separated in the Surrogate-Key header of a PURGE request, like those of the responses.
+
+    :param url: The URL of the purge endpoint of the shared cache
+    :type url: str
+    :param keys: The surrogate keys
+    :type keys: [str]
+    :param timeout: The seconds to wait for the shared cache
+    :type timeout: float
+    :return: The HTTP status of the response of the shared cache
+    :rtype: int
+    """
+    request = Request(url, method='PURGE', headers={'Surrogate-Key': ' '.join(sorted(keys))})
+    with urlopen(request, timeout=timeout) as response:
+        return response.status
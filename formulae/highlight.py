@@ -0,0 +1,63 @@
+from collections import deque
+
+
+class SentenceMatcher(object):
+    """ Finds several word sequences in a list of words at once (the Aho-Corasick algorithm with words as symbols)
+
+    The words are scanned once, whatever the number of sentences, instead of comparing every sentence with every window
+    of the words.
+
+    :param sentences: The word sequences to find
+    :type sentences: [[str]]
+    """
+
+    def __init__(self, sentences):
+        self.sentences = [tuple(words) for words in sentences]
+        # Every node of the trie is a dictionary of its children by word, its failure link and the sentences ending there
+        self.children = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, words in enumerate(self.sentences):
+            if not words:
+                continue
+            node = 0
+            for word in words:
+                if word not in self.children[node]:
+                    self.children.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.children[node][word] = len(self.children) - 1
+                node = self.children[node][word]
+            self.output[node].append(index)
+        queue = deque(self.children[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self.children[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and word not in self.children[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.children[fail].get(word, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, words):
+        """ The position of the first occurrence of every sentence in words
+
+        :param words: The words to search
+        :type words: [str]
+        :return: dictionary with the indices of the sentences found as keys and the (start, end) indices of their first
+            occurrence, end included, as values
+        :rtype: {int: (int, int)}
+        """
+        found = {}
+        node = 0
+        for position, word in enumerate(words):
+            while node and word not in self.children[node]:
+                node = self.fail[node]
+            node = self.children[node].get(word, 0)
+            for index in self.output[node]:
+                if index not in found:
+                    found[index] = (position - len(self.sentences[index]) + 1, position)
+            if len(found) == len(self.sentences):
+                break
+        return found
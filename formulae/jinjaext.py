@@ -0,0 +1,96 @@
+from jinja2 import nodes
+from jinja2.ext import Extension
+from threading import Lock
+from time import perf_counter
+from .cache import BoundedMemoryCache
+
+
+class FragmentCache(object):
+    """ Rendered template fragments, i.e. the bodies of the {% cache %} blocks, kept in a bounded LRU
+
+    The fragments are stored under the key of the context they were rendered in, e.g. the corpus version, the locale and
+    the login state of the user, followed by their name and the values they vary on. The time it took to render every
+    fragment is kept with it, so that the render time saved by the cache can be reported.
+
+    :param context_key: Function returning the key of the current context
+    :type context_key: function
+    :param max_items: The maximum number of fragments. 0 means no limit.
+    :type max_items: int
+
+    :ivar saved: The seconds of rendering saved by the fragments that were found in the cache
+    """
+
+    def __init__(self, context_key=None, max_items=1000):
+        self.context_key = context_key or (lambda: '')
+        self.cache = BoundedMemoryCache(max_items=max_items)
+        self.saved = 0.0
+        self._lock = Lock()
+
+    def render(self, timeout, name, vary_on, caller):
+        """ Retrieve a fragment or render it with caller and keep it
+
+        :param timeout: The seconds the fragment is kept. 0 or None means until it is evicted.
+        :type timeout: int
+        :param name: The name of the fragment
+        :type name: str
+        :param vary_on: The values, other than the context, that the fragment depends on
+        :type vary_on: [Any]
+        :param caller: The function rendering the body of the block
+        :type caller: function
+        :rtype: str
+        """
+        key = '|'.join([self.context_key(), name] + [str(value) for value in vary_on])
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self._lock:
+                self.saved += cached[1]
+            return cached[0]
+        start = perf_counter()
+        fragment = caller()
+        self.cache.set(key, (fragment, perf_counter() - start), timeout or 0)
+        return fragment
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        """ The usage of the cache, e.g. to log it
+
+        :return: The number of fragments, hits, misses and evictions and the seconds of rendering saved
+        :rtype: {str: Any}
+        """
+        return {'items': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses,
+                'evictions': self.cache.evictions, 'saved': round(self.saved, 3)}
+
+
+class FragmentCacheExtension(Extension):
+    """ The {% cache timeout, name, vary_on... %}...{% endcache %} tag backed by the FragmentCache set as the
+    fragment_cache of the environment, e.g. by NemoFormulae
+
+    The syntax is that of the cache tag of Flask-Caching, which flask_nemo's FakeCacheExtension accepts without caching.
+    Without a fragment_cache, the blocks are rendered every time.
+    """
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const("%s%s" % (parser.filename, lineno)))
+        vary_on = []
+        while parser.stream.skip_if('comma'):
+            vary_on.append(parser.parse_expression())
+        args.append(nodes.List(vary_on))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', args), [], [], body).set_lineno(lineno)
+
+    def _cache(self, timeout, name, vary_on, caller):
+        if self.environment.fragment_cache is None:
+            return caller()
+        return self.environment.fragment_cache.render(timeout, name, vary_on, caller)
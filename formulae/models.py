@@ -53,6 +53,58 @@ class NtComRels(db.Model):
         return 'NT: {} --> Commentary: {}'.format(self.nt, self.com)
 
 
+class CitationReff(db.Model):
+    """ The hierarchical reference tree of every text in the corpus.
+        urn is the identifier of the text and version the hash of its textgroup folder when the index was built.
+        level is the citation depth of the reference (1 being the top level) and position its order in the text.
+        parent is the reference one level up (e.g., "1" for "1.5").
+        These records are built by the build-reff-index manager command and allow reference lists, first passages and
+        siblings to be looked up without running the citation XPaths over the TEI.
+        They are kept in the application database rather than in appmeta, whose modification reloads the NT-commentary
+        relations (see NemoFormulae.get_commentary_index).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    urn = db.Column(db.String(256))
+    version = db.Column(db.String(40))
+    level = db.Column(db.Integer)
+    position = db.Column(db.Integer)
+    reff = db.Column(db.String(256))
+    parent = db.Column(db.String(256))
+    __table_args__ = (db.Index('ix_citation_reff_urn_level', 'urn', 'version', 'level', 'position'),
+                      db.Index('ix_citation_reff_urn_parent', 'urn', 'version', 'parent', 'position'))
+
+    def __repr__(self):
+        return '{}:{}'.format(self.urn, self.reff)
+
+    @staticmethod
+    def rebuild(resolver, objectIds=None):
+        """ (Re-)Extracts the reference tree of texts into the index
+
+        :param resolver: The corpus resolver
+        :type resolver: FormulaeCTSResolver
+        :param objectIds: The identifiers of the texts to index. If None, all texts are indexed.
+        :type objectIds: [str]
+        :return: The number of references indexed
+        :rtype: int
+        """
+        if objectIds is None:
+            objectIds = [text.id for text in resolver.getMetadata().readableDescendants]
+        count = 0
+        for objectId in objectIds:
+            CitationReff.query.filter_by(urn=objectId).delete()
+            version = resolver.text_version(objectId)
+            rows = []
+            for level in range(1, len(resolver.getMetadata(objectId).citation) + 1):
+                for position, reff in enumerate(resolver.getReffs(objectId, level=level)):
+                    reff = str(reff)
+                    rows.append({'urn': objectId, 'version': version, 'level': level, 'position': position,
+                                 'reff': reff, 'parent': '.'.join(reff.split('.')[:-1]) or None})
+            db.session.bulk_insert_mappings(CitationReff, rows)
+            count += len(rows)
+        db.session.commit()
+        return count
+
+
 @login.user_loader
 def load_user(id):
     return User.query.get(int(id))
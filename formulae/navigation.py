@@ -0,0 +1,59 @@
+from flask_nemo.common import join_or_single
+import sys
+
+
+class SiblingTable(object):
+    """ The references of a text at every citation depth and the groups of them that are browsed (see Nemo.chunk), to
+    find the previous and next passages of a passage by looking up its position
+
+    :param levels: The references of every citation depth, from the top
+    :type levels: [[str]]
+    :param chunks: The references of the browsed passages, e.g. "1.1-1.20"
+    :type chunks: [str]
+    """
+    __slots__ = ('levels', 'chunks', 'positions', 'chunk_positions')
+
+    def __init__(self, levels, chunks):
+        self.levels = tuple(tuple(sys.intern(str(reff)) for reff in level) for level in levels)
+        self.chunks = tuple(sys.intern(str(reff)) for reff in chunks)
+        self.positions = {reff: (depth, position) for depth, level in enumerate(self.levels)
+                          for position, reff in enumerate(level)}
+        self.chunk_positions = {reff: position for position, reff in enumerate(self.chunks)}
+
+    @property
+    def first(self):
+        """ The first browsed passage
+
+        :rtype: str
+        """
+        if self.chunks:
+            return self.chunks[0]
+        return self.levels[0][0] if self.levels and self.levels[0] else None
+
+    def siblings(self, subreference):
+        """ The previous and next passages of a passage
+
+        A browsed passage has the browsed passages before and after it as siblings. Any other passage, a single
+        reference or a range within one citation depth, has the passages of the same length before and after it, cut at
+        the start and the end of the text.
+
+        :param subreference: The reference of the passage, e.g. "1.5" or "1.1-1.20"
+        :type subreference: str
+        :return: The previous and next references, None where there is none, or None if the passage is not in the text
+        :rtype: (str, str)
+        """
+        position = self.chunk_positions.get(subreference)
+        if position is not None:
+            return (self.chunks[position - 1] if position > 0 else None,
+                    self.chunks[position + 1] if position < len(self.chunks) - 1 else None)
+        start, _, end = subreference.partition('-')
+        start = self.positions.get(start)
+        end = self.positions.get(end) if end else start
+        if start is None or end is None or start[0] != end[0] or start[1] > end[1]:
+            return None
+        level = self.levels[start[0]]
+        start, end = start[1], end[1]
+        length = end - start + 1
+        prev = join_or_single(level[max(start - length, 0)], level[start - 1]) if start > 0 else None
+        next = join_or_single(level[end + 1], level[min(end + length, len(level) - 1)]) if end < len(level) - 1 else None
+        return prev, next
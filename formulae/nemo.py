@@ -1,4 +1,5 @@
-from flask import url_for, Markup, g, session, flash, request
+from flask import url_for, Markup, g, session, flash, request, copy_current_request_context, _request_ctx_stack, \
+    has_request_context
 from flask_login import current_user, login_required
 from flask_babel import _, refresh, get_locale
 from flask_babel import lazy_gettext as _l
@@ -6,16 +7,38 @@ from werkzeug.utils import redirect
 from flask_nemo import Nemo
 from rdflib.namespace import DCTERMS, Namespace
 from MyCapytain.common.constants import Mimetypes
+from MyCapytain.common.reference import URN
 from MyCapytain.resources.prototypes.cts.inventory import CtsWorkMetadata, CtsEditionMetadata
 from MyCapytain.errors import UnknownCollection
 from formulae.search.forms import SearchForm
 from lxml import etree
+from jinja2 import TemplateError, FileSystemBytecodeCache
 from .errors.handlers import e_internal_error, e_not_found_error, e_unknown_collection_error
 import re
-from datetime import date
+from datetime import date, datetime
 from string import punctuation
-from .models import NtComRels
+from .models import NtComRels, CitationReff
+from .startup import StartupReport
+from .records import Catalogue, MemberRecord
+from .xslt import XSLTRegistry
+from .highlight import SentenceMatcher
+from .relations import CommentaryIndex
+from .navigation import SiblingTable
+from .cache import BoundedMemoryCache, CachePolicy, purge_surrogate_keys
+from .jinjaext import FragmentCache, FragmentCacheExtension
+from . import db
+from sqlalchemy.exc import SQLAlchemyError
 from operator import itemgetter
+from collections import OrderedDict
+from types import MappingProxyType
+from glob import glob
+from threading import BoundedSemaphore, Lock, Thread, local
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import hashlib
+import json
+import os
+import tempfile
 
 
 class NemoFormulae(Nemo):
@@ -63,6 +86,44 @@ class NemoFormulae(Nemo):
         # "view_maker", "route", #"render",
     ]
 
+    # Routes whose pages only depend on the corpus, their arguments, the locale and the user, and so can be answered
+    # with 304 Not Modified when the browser already has the current version
+    CONDITIONAL_ROUTES = [
+        "r_collections", "r_collection", "r_work", "r_references", "r_multipassage", "r_add_text_collections",
+        "r_add_text_collection", "r_add_text_work", "r_impressum", "r_commentary_view"
+    ]
+
+    # Routes that list the collections of the corpus and so change whenever a textgroup is added, changed or removed
+    COLLECTION_ROUTES = [
+        "r_collections", "r_collection", "r_add_text_collections", "r_add_text_collection", "r_add_text_work"
+    ]
+    # How the responses of the routes may be cached. The corpus pages are kept by the shared cache until the
+    # CACHE_MAX_AGE setting expires or their texts are reloaded and they are purged by their surrogate keys.
+    CORPUS_CACHE_POLICY = CachePolicy(max_age='CACHE_BROWSER_MAX_AGE', s_maxage='CACHE_MAX_AGE',
+                                      vary=('Cookie', 'Accept-Language'))
+    # The static files of the app and of all blueprints (e.g. the assets of Nemo and of Bootstrap) are the same for all
+    # users and so are shared without looking at the session
+    STATIC_CACHE_POLICY = CachePolicy(max_age='CACHE_MAX_AGE', s_maxage='CACHE_MAX_AGE')
+    CACHE_POLICIES = {
+        "r_index": CORPUS_CACHE_POLICY,
+        "r_collections": CORPUS_CACHE_POLICY,
+        "r_collection": CORPUS_CACHE_POLICY,
+        "r_work": CORPUS_CACHE_POLICY,
+        "r_references": CORPUS_CACHE_POLICY,
+        "r_multipassage": CORPUS_CACHE_POLICY,
+        "r_add_text_collections": CORPUS_CACHE_POLICY,
+        "r_add_text_collection": CORPUS_CACHE_POLICY,
+        "r_add_text_work": CORPUS_CACHE_POLICY,
+        "r_set_language": CachePolicy(no_store=True),
+        "r_impressum": CORPUS_CACHE_POLICY,
+        "r_commentary_view": CORPUS_CACHE_POLICY,
+        "r_first_passage": CORPUS_CACHE_POLICY,
+        "secondary_assets": STATIC_CACHE_POLICY,
+        "static": STATIC_CACHE_POLICY
+    }
+    # The routes of the app and the blueprints without a policy are only kept by the browser of the user, if at all
+    DEFAULT_CACHE_POLICY = CachePolicy()
+
     OPEN_NOTES = []
 
     LANGUAGE_MAPPING = {"lat": _l('Latein'), "deu": _l("Deutsch"), "fre": _l("Französisch"),
@@ -70,33 +131,409 @@ class NemoFormulae(Nemo):
 
     BIBO = Namespace('http://bibliotek-o.org/1.0/ontology/')
 
+    # Characters that are ignored when search results are highlighted
+    PUNCTUATION = re.compile('[{}„“…]'.format(punctuation))
+
+    CATALOGUE_FORMAT = 2
+    # None is the language of sub_colls, the others are those that get_locale can return
+    CATALOGUE_LANGUAGES = (None, 'ger', 'eng', 'fre')
+
     def __init__(self, *args, **kwargs):
         if "pdf_folder" in kwargs:
             self.pdf_folder = kwargs["pdf_folder"]
             del kwargs["pdf_folder"]
-        super(NemoFormulae, self).__init__(*args, **kwargs)
-        self.sub_colls = self.get_all_corpora()
+        self.startup_report = kwargs.pop("startup_report", None) or StartupReport()
+        self.passage_cache = kwargs.pop("passage_cache", None)
+        if self.passage_cache is None:
+            self.passage_cache = BoundedMemoryCache(max_items=1000)
+        self.fragments = kwargs.pop("fragments", None)
+        # The threads are only started by the first request that renders several passages, i.e. after the fork
+        self.passage_workers = kwargs.pop("passage_workers", 4)
+        self.passage_executor = ThreadPoolExecutor(max_workers=self.passage_workers)
+        # The messages flashed by the passage threads, which are flashed by the request thread (see passage_task)
+        self.passage_messages = local()
+        self.prefetch_commentaries = kwargs.pop("prefetch_commentaries", False)
+        # The prefetching has its own thread so that it never delays the passages of the requests waiting for the pool.
+        # At most two prefetches, i.e. the passages around one NT passage, are queued or running. Others are dropped.
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_slots = BoundedSemaphore(2)
+        # Whether the citation index table exists, checked on its first use and again after a reload
+        self.citation_index_exists = None
+        # The sibling tables of the most recently browsed (or preloaded) texts, with the text version they were built for
+        self.sibling_tables = BoundedMemoryCache(max_items=kwargs.pop("sibling_table_items", 1000))
+        self.xslt = XSLTRegistry(check_interval=kwargs.pop("xslt_check_interval", 0))
+        fragment_cache_items = kwargs.pop("fragment_cache_items", 1000)
+        template_cache_folder = kwargs.pop("template_cache_folder", None)
+        with self.startup_report.phase('nemo'):
+            super(NemoFormulae, self).__init__(*args, **kwargs)
+        # The {% cache %} blocks of the templates are kept for every corpus version, locale and login state
+        self.app.jinja_env.extensions.pop('flask_nemo.jinjaext.FakeCacheExtension', None)
+        self.app.jinja_env.add_extension(FragmentCacheExtension)
+        self.app.jinja_env.fragment_cache = FragmentCache(self.fragment_context_key, max_items=fragment_cache_items)
+        # The compiled templates are loaded from this folder, filled by the precompile manager command, instead of
+        # being compiled again by every worker
+        if template_cache_folder is not None:
+            os.makedirs(template_cache_folder, exist_ok=True)
+            self.app.jinja_env.bytecode_cache = FileSystemBytecodeCache(template_cache_folder)
+        with self.startup_report.phase('catalogue'):
+            self.refresh_catalogue()
+        with self.startup_report.phase('commentary_index'):
+            self.appmeta_database = self.get_appmeta_database()
+            self.commentary_index = self.load_commentary_index()
+        self.last_corpus_check = time()
+        self.last_reload_trigger = self.reload_trigger_time()
+        self.reload_lock = Lock()
+        # The thread of the last reload started by check_corpus
+        self.reload_thread = None
         self.app.jinja_env.filters["remove_from_list"] = self.f_remove_from_list
         self.app.jinja_env.filters["join_list_values"] = self.f_join_list_values
         self.app.jinja_env.filters["replace_indexed_item"] = self.f_replace_indexed_item
+        self.app.jinja_env.filters["make_members"] = self.f_make_members
         self.app.register_error_handler(404, e_not_found_error)
         self.app.register_error_handler(500, e_internal_error)
+        self.templates_version = self.get_templates_version()
         self.app.before_request(self.before_request)
         self.app.after_request(self.after_request)
 
+    def refresh_catalogue(self):
+        """ Load the sub-collection catalogue of the current corpus version and the structures derived from it"""
+        self.catalogue = self.load_catalogue()
+        self.sub_colls = self.get_all_corpora()
+        self.corpus_choices = tuple((x['id'].split(':')[-1], x['short_title'].strip())
+                                    for y in self.sub_colls.values() for x in y if 'commentary' not in x['id'])
+        self.versions = self.build_versions()
+
+    def preload(self):
+        """ Build what the workers would otherwise build lazily on their first requests, i.e. the inventory, the
+        version map of its texts, the sibling tables of the texts in the citation index, the compiled templates and the
+        compiled XSL stylesheets
+
+        This is called in the gunicorn master so that the forked workers share these structures copy-on-write.
+        The sibling tables of the texts that are not indexed are left to be built on their first request, since they
+        would require every TEI file to be parsed at boot.
+        """
+        with self.startup_report.phase('preload'):
+            inventory = self.resolver.getMetadata()
+            if hasattr(self.resolver, 'text_version'):
+                self.resolver.text_version(inventory.id)
+            with self.app.app_context():
+                indexed = self.get_indexed_texts()
+                for text in inventory.readableDescendants:
+                    if text.id in indexed:
+                        self.get_sibling_table(text.id)
+            compiled, errors = self.compile_templates()
+            for template, E in errors.items():
+                self.app.logger.warning("Template %s could not be compiled: %s", template, E)
+            for xsl in self._transform.values():
+                if isinstance(xsl, str):
+                    self.xslt.get(xsl)
+
+    def compile_templates(self):
+        """ Compile the templates of the app and of all its blueprints, e.g. the main::, search::, auth:: and errors::
+        templates of Nemo, which also writes them to the bytecode cache if there is one
+
+        :return: The names of the compiled templates and the errors of the templates that could not be compiled
+        :rtype: ([str], {str: TemplateError})
+        """
+        compiled, errors = [], OrderedDict()
+        for template in self.app.jinja_env.list_templates(extensions=['html', 'xml']):
+            try:
+                self.app.jinja_env.get_template(template)
+                compiled.append(template)
+            except TemplateError as E:
+                errors[template] = E
+        return compiled, errors
+
+    def reload(self):
+        """ Re-parse the textgroups of the corpus that have changed and refresh the sub-collection catalogue
+
+        Concurrent calls return immediately while a reload is running.
+
+        :return: The textgroup folders that have changed
+        :rtype: [str]
+        """
+        if not self.reload_lock.acquire(blocking=False):
+            return []
+        return self.run_reload()
+
+    def run_reload(self):
+        """ Reload the corpus while holding reload_lock, which the caller has acquired, and release it
+
+        The reload trigger is only recorded as handled here, with the time it had before the reload started, so that
+        the triggers touched during a reload, e.g. by another thread, are handled by the next check_corpus.
+
+        :return: The textgroup folders that have changed
+        :rtype: [str]
+        """
+        trigger = self.reload_trigger_time()
+        now = time()
+        try:
+            # The reload may run in the thread started by check_corpus, outside of any request
+            with self.app.app_context():
+                changed = self.resolver.reload()
+                if changed:
+                    # The citation index may have been built for the new texts
+                    self.citation_index_exists = None
+                    self.refresh_catalogue()
+                    # The fragments of the old corpus version are not used anymore
+                    fragment_cache = self.app.jinja_env.fragment_cache
+                    self.app.logger.info("Template fragment cache: %s", fragment_cache.stats())
+                    fragment_cache.clear()
+                    self.purge_cache(getattr(self.resolver, 'reloaded_textgroups', []) + ['collections'])
+                if self.commentary_index.version is None:
+                    # Changes to relations that are not in an SQLite file cannot be detected otherwise
+                    self.commentary_index = self.load_commentary_index()
+            return changed
+        finally:
+            self.last_reload_trigger = trigger
+            self.last_corpus_check = now
+            self.reload_lock.release()
+
+    def check_corpus(self):
+        """ Reload the corpus if its reload trigger was touched (e.g., by the reload manager command) since the last
+        reload or, when CORPUS_RELOAD_INTERVAL is set, if that many seconds have passed since the last check
+
+        The reload runs in a background thread so that the request that noticed the change does not wait for it. The
+        other requests are served from the current inventory until the reloaded one replaces it.
+        """
+        if not hasattr(self.resolver, 'reload'):
+            return
+        trigger = self.reload_trigger_time()
+        interval = self.app.config.get('CORPUS_RELOAD_INTERVAL', 0)
+        if trigger != self.last_reload_trigger or (interval and time() - self.last_corpus_check >= interval):
+            if self.reload_lock.acquire(blocking=False):
+                self.reload_thread = Thread(target=self.run_reload, name='corpus-reload', daemon=True)
+                self.reload_thread.start()
+
+    def get_appmeta_database(self):
+        """ The file of the appmeta database
+
+        :return: The path or None if the database is not an SQLite file
+        :rtype: str
+        """
+        try:
+            with self.app.app_context():
+                engine = db.get_engine(self.app, bind='appmeta')
+        except (AssertionError, KeyError):
+            return None
+        if engine.url.drivername != 'sqlite':
+            return None
+        return engine.url.database or None
+
+    def commentary_index_version(self):
+        """ The version of the NT-commentary relations, i.e. the modification time of the appmeta database file
+
+        :return: The modification time or None if the database is not a file or does not exist
+        :rtype: int
+        """
+        if self.appmeta_database is None:
+            return None
+        try:
+            return os.stat(self.appmeta_database).st_mtime_ns
+        except OSError:
+            return None
+
+    def load_commentary_index(self):
+        """ Read the NT-commentary relations from the appmeta database into an index of their reference intervals
+
+        :rtype: CommentaryIndex
+        """
+        version = self.commentary_index_version()
+        try:
+            with self.app.app_context():
+                relations = [(row.nt, row.com.replace('greekLit', 'cjhnt')) for row in
+                             NtComRels.query.with_entities(NtComRels.nt, NtComRels.com).order_by(NtComRels.id)]
+        except SQLAlchemyError as E:
+            self.app.logger.warning("The NT-commentary relations could not be read: %s", E)
+            relations = []
+        return CommentaryIndex(relations, version=version)
+
+    def get_commentary_index(self):
+        """ The index of the NT-commentary relations, loaded again if the appmeta database has changed
+
+        :rtype: CommentaryIndex
+        """
+        version = self.commentary_index_version()
+        if version is not None and version != self.commentary_index.version:
+            self.commentary_index = self.load_commentary_index()
+            self.purge_cache(['nt_com'])
+        return self.commentary_index
+
+    def reload_trigger_time(self):
+        """ The modification time of the reload trigger of the resolver
+
+        :return: The modification time or None if there is no trigger
+        :rtype: float
+        """
+        try:
+            return os.path.getmtime(self.resolver.reload_trigger)
+        except (AttributeError, TypeError, OSError):
+            return None
+
     def get_all_corpora(self):
         """ A convenience function to return all sub-corpora in all collections
 
         :return: dictionary with all the collections as keys and a list of the corpora in the collection as values
         """
-        colls = {}
-        for member in self.make_members(self.resolver.getMetadata(), lang=None):
-            members = self.make_members(self.resolver.getMetadata(member['id']))
-            for m in members:
-                m.update({'short_title':
-                              str(self.resolver.getMetadata(m['id']).metadata.get_single(self.BIBO.AbbreviatedTitle))})
-            colls[member['id']] = members
-        return colls
+        members = self.catalogue[''].members
+        return MappingProxyType({member.id: members[member.id] for member in members[self.catalogue_root]})
+
+    @property
+    def catalogue_root(self):
+        """ The identifier of the top-level collection of the inventory
+
+        :rtype: str
+        """
+        return self.resolver.getMetadata().id
+
+    @property
+    def catalogue_path(self):
+        """ The path of the sub-collection catalogue for the current corpus version
+
+        :return: The path or None if the resolver does not save snapshots
+        :rtype: str
+        """
+        folder = getattr(self.resolver, 'snapshot_folder', None)
+        if folder is None:
+            return None
+        return os.path.join(folder, 'catalogue-v{}-{}.json'.format(self.CATALOGUE_FORMAT,
+                                                                   self.resolver.corpus_version))
+
+    def build_catalogue(self):
+        """ Build the members of every collection in every language of CATALOGUE_LANGUAGES
+
+        The members of the collections below the top-level collections also carry their short title.
+
+        :return: dictionary with the language codes ('' for None) as keys and, as values, dictionaries with the
+            collection identifiers as keys and the values of the MemberRecords of their members as values
+        :rtype: {str: {str: [[Any]]}}
+        """
+        catalogue = {}
+        for lang in self.CATALOGUE_LANGUAGES:
+            collections = {}
+            pending = [self.resolver.getMetadata()]
+            while pending:
+                collection = pending.pop()
+                members = []
+                for member in self.make_members(collection, lang=lang):
+                    if collection.children[member['id']].readable is True:
+                        collections[member['id']] = []
+                    else:
+                        metadata = self.resolver.getMetadata(member['id'])
+                        member['short_title'] = str(metadata.metadata.get_single(self.BIBO.AbbreviatedTitle))
+                        pending.append(metadata)
+                    members.append(MemberRecord.from_member(member, parent=collection.id).values())
+                collections[collection.id] = members
+            catalogue[lang or ''] = collections
+        return catalogue
+
+    def load_catalogue(self):
+        """ Load the sub-collection catalogue of the current corpus version or, if it has not been saved yet, build
+        and save it
+
+        :return: The Catalogue of every language code ('' for None)
+        :rtype: {str: Catalogue}
+        """
+        path = self.catalogue_path
+        catalogue = None
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+                if saved.get('format') == self.CATALOGUE_FORMAT and \
+                        saved.get('corpus_version') == self.resolver.corpus_version:
+                    catalogue = saved['catalogue']
+            except (OSError, ValueError) as E:
+                self.app.logger.warning("Catalogue %s could not be loaded: %s", path, E)
+        if catalogue is None:
+            catalogue = self.build_catalogue()
+            if path is not None and catalogue[''].get(self.catalogue_root):
+                self.save_catalogue(catalogue)
+        return MappingProxyType({lang: Catalogue(members) for lang, members in catalogue.items()})
+
+    def save_catalogue(self, catalogue):
+        """ Save the sub-collection catalogue of the current corpus version and remove the older ones
+
+        :param catalogue: The catalogue as returned by build_catalogue
+        :type catalogue: {str: {str: [[Any]]}}
+        """
+        path = self.catalogue_path
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=folder, delete=False) as f:
+            json.dump({'format': self.CATALOGUE_FORMAT, 'corpus_version': self.resolver.corpus_version,
+                       'catalogue': catalogue}, f, separators=(',', ':'))
+        os.replace(f.name, path)
+        for old in glob(os.path.join(folder, 'catalogue-*.json')):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def build_versions(self):
+        """ Index the readable versions, i.e. the editions and translations, that can be shown next to each text or work
+
+        These are the readable descendants of the parent of the text or work. The texts with the same parent share the
+        same tuple of records.
+
+        :return: dictionary with the text and work identifiers as keys and the records of the versions as values
+        :rtype: {str: (MemberRecord)}
+        """
+        versions = {}
+        by_parent = {}
+        for text in self.resolver.getMetadata().readableDescendants:
+            for member in (text, text.parent):
+                parent = member.parent
+                if member.id in versions or parent is None:
+                    continue
+                if parent.id not in by_parent:
+                    by_parent[parent.id] = tuple(self.make_version(m) for m in parent.readableDescendants)
+                versions[member.id] = by_parent[parent.id]
+        return MappingProxyType(versions)
+
+    def get_versions(self, objectId, exclude=()):
+        """ Retrieve the readable versions that can be shown next to a text or work
+
+        :param objectId: Text or work identifier
+        :type objectId: str
+        :param exclude: Identifiers of the versions to leave out, e.g. those already shown
+        :type exclude: [str]
+        :return: The records of the versions
+        :rtype: [MemberRecord]
+        """
+        versions = self.versions.get(objectId)
+        if versions is None:
+            parent = self.resolver.getMetadata(self.resolver.getMetadata(objectId).parent.id)
+            versions = [self.make_version(m) for m in parent.readableDescendants]
+        return [v for v in versions if v.id not in exclude]
+
+    @staticmethod
+    def make_version(text):
+        """ Build the record of a readable version as it is shown in the version menus
+
+        :param text: The metadata of the text
+        :type text: XmlCtsTextMetadata
+        :rtype: MemberRecord
+        """
+        return MemberRecord.from_member({"id": text.id, "label": str(text.get_label()), "model": str(text.model),
+                                         "type": str(text.type), "lang": text.lang})
+
+    def get_catalogue_members(self, objectId, lang=None):
+        """ Retrieve the members of a collection from the catalogue
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param lang: Lang in which to express main data
+        :type lang: str
+        :return: The members of the collection
+        :rtype: (MemberRecord)
+        """
+        catalogue = self.catalogue.get(lang or '')
+        members = catalogue.members.get(objectId) if catalogue is not None else None
+        if members is None:
+            return self.make_members(self.resolver.getMetadata(objectId), lang=lang)
+        return members
 
     def check_project_team(self):
         """ A convenience function that checks if the current user is a part of the project team"""
@@ -143,6 +580,15 @@ class NemoFormulae(Nemo):
         l.remove(i)
         return l
 
+    def f_make_members(self, collection, lang=None):
+        """ the members of the collection "collection" from the catalogue
+
+        :param collection: the collection, e.g. one of main_collections
+        :param lang: the language of the labels
+        :return: the members of the collection
+        """
+        return self.get_catalogue_members(collection['id'], lang=lang)
+
     def f_join_list_values(self, l, s):
         """ join the values of "l" user the separator "s"
 
@@ -173,25 +619,240 @@ class NemoFormulae(Nemo):
         refresh()
 
     def before_request(self):
+        self.check_corpus()
         g.search_form = SearchForm()
+        g.etag, g.last_modified = self.get_validators()
+        if g.etag is not None and self.not_modified(g.etag, g.last_modified):
+            return self.app.response_class(status=304)
 
     def after_request(self, response):
-        """ Currently used only for the Cache-Control header
-            max_age calculates days, hours, minutes and seconds and adds them together.
-            First number after '+' is the respective number for each value.
+        """ Set the caching headers of a response: Cache-Control and Vary according to the cache policy of its route,
+        the surrogate keys by which the shared cache can purge it and the validators of the conditional routes
         """
-        response.cache_control.max_age = self.app.config['CACHE_MAX_AGE']
-        response.cache_control.public = True
+        policy = self.get_cache_policy()
+        # Pages that show or will show flashed messages and pages of logged-in users must not be shared. Only the shared
+        # routes that depend on the session (i.e. vary on Cookie) look for them, so that e.g. the static files are
+        # served without opening the session or loading the user.
+        personal = policy.shared and 'Cookie' in policy.vary
+        flashed = False
+        if personal or getattr(g, 'etag', None) is not None:
+            flashed = bool(getattr(_request_ctx_stack.top, 'flashes', None) or session.get('_flashes'))
+        policy.apply(response, self.app.config, private=personal and (flashed or current_user.is_authenticated))
+        keys = self.get_surrogate_keys() if response.cache_control.public else None
+        if keys:
+            response.headers['Surrogate-Key'] = ' '.join(sorted(keys))
+        # Pages that show flashed messages must not be answered from the browser cache later
+        if getattr(g, 'etag', None) is not None and response.status_code in (200, 304) and not flashed:
+            response.set_etag(g.etag)
+            if g.last_modified is not None:
+                response.last_modified = g.last_modified
         return response
 
+    def get_cache_policy(self):
+        """ The cache policy of the route of the current request, from CACHE_POLICIES for the routes of Nemo and the
+        app, from the cache_policies of the other blueprints and STATIC_CACHE_POLICY for the static files of all of them
+
+        :rtype: CachePolicy
+        """
+        if request.endpoint is None:
+            return self.DEFAULT_CACHE_POLICY
+        if request.endpoint.split('.')[-1] == 'static':
+            return self.STATIC_CACHE_POLICY
+        if request.blueprint is None or request.blueprint == self.blueprint.name:
+            policies = self.CACHE_POLICIES
+        else:
+            policies = getattr(self.app.blueprints.get(request.blueprint), 'cache_policies', {})
+        return policies.get(request.endpoint.split('.')[-1], self.DEFAULT_CACHE_POLICY)
+
+    @staticmethod
+    def object_keys(objectId):
+        """ The surrogate keys of a collection or a text: its identifier and that of its textgroup, which is purged when
+        the textgroup is reloaded
+
+        :param objectId: The identifier of the collection or text
+        :type objectId: str
+        :rtype: [str]
+        """
+        try:
+            textgroup = str(URN(objectId).upTo(URN.TEXTGROUP))
+        except (ValueError, KeyError, IndexError):
+            return [objectId]
+        return [objectId, textgroup] if textgroup and textgroup != objectId else [objectId]
+
+    def add_surrogate_keys(self, *objectIds):
+        """ Tag the response of the current request with the surrogate keys of collections or texts that it shows in
+        addition to those in the arguments of its route
+
+        :param objectIds: The identifiers of the collections or texts
+        :type objectIds: str
+        """
+        keys = g.setdefault('surrogate_keys', set())
+        for objectId in objectIds:
+            keys.update(self.object_keys(objectId))
+
+    def get_surrogate_keys(self):
+        """ The surrogate keys of the response of the current request, i.e. those of the collections and texts that it
+        shows, 'collections' for the lists of collections and 'nt_com' for the NT-commentary view
+
+        :rtype: {str}
+        """
+        keys = set(g.get('surrogate_keys', ()))
+        args = request.view_args or {}
+        for objectId in [args.get('objectId', '')] + args.get('objectIds', '').split('+'):
+            if objectId:
+                keys.update(self.object_keys(objectId))
+        endpoint = (request.endpoint or '').split('.')[-1]
+        if endpoint in self.COLLECTION_ROUTES:
+            keys.add('collections')
+        elif endpoint == 'r_commentary_view':
+            keys.add('nt_com')
+        return keys
+
+    def purge_cache(self, keys):
+        """ Ask the shared cache to drop the responses tagged with the surrogate keys, if CACHE_PURGE_URL is set
+
+        :param keys: The surrogate keys, e.g. those of reloaded textgroups
+        :type keys: [str]
+        :return: Whether the shared cache was asked to purge the keys
+        :rtype: bool
+        """
+        url = self.app.config.get('CACHE_PURGE_URL')
+        if not url or not keys:
+            return False
+        try:
+            purge_surrogate_keys(url, keys)
+        except Exception as E:
+            self.app.logger.warning("The shared cache could not purge %s: %s", ' '.join(keys), E)
+            return False
+        self.app.logger.info("Purged %s from the shared cache", ' '.join(keys))
+        return True
+
+    def get_templates_version(self):
+        """ The latest modification time of the templates and XSL stylesheets, which change the pages as the corpus does
+
+        :rtype: int
+        """
+        paths = [xsl for xsl in self._transform.values() if isinstance(xsl, str)]
+        for namespace, folder in self.__templates_namespaces__:
+            for root, dirs, files in os.walk(folder):
+                paths += [os.path.join(root, name) for name in files]
+        return max([os.stat(path).st_mtime_ns for path in paths if os.path.isfile(path)] or [0])
+
+    def fragment_context_key(self):
+        """ The key of the context in which the template fragments are rendered: the corpus version, the locale and
+        whether the user is logged in and a member of the project team
+
+        :rtype: str
+        """
+        if not has_request_context():
+            return str(getattr(self.resolver, 'corpus_version', None))
+        user = 'anonymous'
+        if current_user.is_authenticated:
+            user = 'project_team' if self.check_project_team() else 'user'
+        return '|'.join([str(getattr(self.resolver, 'corpus_version', None)), self.get_locale(), user])
+
+    def get_validators(self):
+        """ The ETag and Last-Modified time of the page of the current request if it is a conditional route
+
+        The ETag is computed from the versions of the corpus, of the NT-commentary relations and of the templates, the
+        path and arguments of the request, the locale, the user and the date, which the passage pages show for their
+        citation. The NT-commentary relations are checked for changes here, since the 304 responses are sent before the
+        pages that would load them again are rendered. The Last-Modified time is the latest of when the inventory was
+        parsed, when the NT-commentary relations and the templates were modified and midnight.
+
+        :return: The ETag and the Last-Modified time or (None, None) if the page cannot be validated
+        :rtype: (str, datetime)
+        """
+        corpus_version = getattr(self.resolver, 'corpus_version', None)
+        if request.method not in ('GET', 'HEAD') or corpus_version is None or request.blueprint != self.blueprint.name \
+                or request.endpoint.split('.')[-1] not in self.CONDITIONAL_ROUTES or session.get('_flashes'):
+            return None, None
+        user = 'anonymous'
+        if current_user.is_authenticated:
+            user = '{}:{}'.format(current_user.get_id(), self.check_project_team())
+        today = date.today()
+        commentary_version = self.get_commentary_index().version
+        etag = hashlib.sha1('|'.join([
+            corpus_version, str(commentary_version), str(self.templates_version), request.full_path,
+            self.get_locale(), user, today.isoformat()
+        ]).encode('utf-8')).hexdigest()
+        last_modified = datetime.utcfromtimestamp(max(getattr(self.resolver, 'snapshot_time', None) or 0,
+                                                      (commentary_version or 0) / 1e9, self.templates_version / 1e9,
+                                                      datetime(today.year, today.month, today.day).timestamp()))
+        return etag, last_modified.replace(microsecond=0)
+
+    def not_modified(self, etag, last_modified):
+        """ Whether the browser already has the current version of the page, i.e. whether it sent its ETag or, without
+        an ETag, a time after its Last-Modified time
+
+        The Last-Modified time does not change with the locale or the login of the session, so it is only used for the
+        requests without a session cookie.
+
+        :param etag: The ETag of the page
+        :type etag: str
+        :param last_modified: The Last-Modified time of the page
+        :type last_modified: datetime
+        :rtype: bool
+        """
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        if request.if_modified_since is not None and last_modified is not None \
+                and self.app.session_cookie_name not in request.cookies:
+            return request.if_modified_since >= last_modified
+        return False
+
+    def r_collections(self, lang=None):
+        """ Retrieve the top collections of the inventory
+
+        :param lang: Lang in which to express main data
+        :type lang: str
+        :return: Collections information and template
+        :rtype: {str: Any}
+        """
+        collection = self.resolver.getMetadata()
+        return {
+            "template": "main::collection.html",
+            "current_label": collection.get_label(lang),
+            "collections": {
+                "members": self.get_catalogue_members(collection.id, lang=lang)
+            }
+        }
+
     def r_collection(self, objectId, lang=None):
-        data = super(NemoFormulae, self).r_collection(objectId, lang=lang)
-        data['interface'] = request.args.get('interface')
+        """ Collection content browsing route function
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param lang: Lang in which to express main data
+        :type lang: str
+        :return: Template and collections contained in given collection
+        :rtype: {str: Any}
+        """
+        catalogue = self.catalogue.get(lang or '')
+        current = catalogue.records.get(objectId) if catalogue is not None else None
+        if current is not None:
+            parents = catalogue.parents(current)
+        else:
+            collection = self.resolver.getMetadata(objectId)
+            current = {
+                "label": str(collection.get_label(lang)),
+                "id": collection.id,
+                "model": str(collection.model),
+                "type": str(collection.type),
+            }
+            parents = self.make_parents(collection, lang=lang)
         new_members = []
-        for member in sorted(data['collections']['members'], key=itemgetter('id')):
-            new_members.append([member, self.make_members(self.resolver.getMetadata(member['id']), lang=lang)])
-        data['collections']['members'] = new_members
-        return data
+        for member in sorted(self.get_catalogue_members(current['id'], lang=lang), key=itemgetter('id')):
+            new_members.append([member, self.get_catalogue_members(member['id'], lang=lang)])
+        return {
+            "template": "main::collection.html",
+            "collections": {
+                "current": current,
+                "members": new_members,
+                "parents": parents
+            },
+            'interface': request.args.get('interface')
+        }
 
     def r_work(self, objectId, lang=None):
         """ Route to browse collections and add another text to the view
@@ -204,8 +865,14 @@ class NemoFormulae(Nemo):
         :rtype: [(str, list)]
         """
         collection = self.resolver.getMetadata(objectId)
-        reffs = self.resolver.getReffs(objectId)
-        r = [(reff, self.resolver.getReffs(objectId, subreference=reff)) for reff in reffs]
+        r = self.get_indexed_reff_tree(objectId)
+        if r is None:
+            if hasattr(self.resolver, 'getReffTree'):
+                # Texts with a single citation level have no children
+                r = [node if isinstance(node, tuple) else (node, []) for node in self.resolver.getReffTree(objectId)]
+            else:
+                reffs = self.resolver.getReffs(objectId)
+                r = [(reff, self.resolver.getReffs(objectId, subreference=reff)) for reff in reffs]
         return {
             "template": "main::sub_collection.html",
             "collections": {
@@ -235,7 +902,8 @@ class NemoFormulae(Nemo):
             "template": "main::collection.html",
             "current_label": collection.get_label(lang),
             "collections": {
-                "members": [[member, self.make_members(self.resolver.getMetadata(member['id']), lang=lang)] for member in self.make_members(collection, lang=lang)]
+                "members": [[member, self.get_catalogue_members(member['id'], lang=lang)]
+                            for member in self.get_catalogue_members(collection.id, lang=lang)]
             },
             "prev_texts": objectIds,
             "prev_reffs": reffs
@@ -279,6 +947,122 @@ class NemoFormulae(Nemo):
         initial.update({'prev_texts': objectIds, 'prev_reffs': reffs, 'interface': 'reading'})
         return initial
 
+    def get_reffs(self, objectId, subreference=None, collection=None, export_collection=False):
+        """ Retrieve and transform a list of references, using the citation index where possible
+
+        :param objectId: Collection Identifier
+        :type objectId: str
+        :param subreference: Subreference from which to retrieve children
+        :type subreference: str
+        :param collection: Collection object bearing metadata
+        :type collection: Collection
+        :param export_collection: Return collection metadata
+        :type export_collection: bool
+        :return: Returns either the list of references, or the text collection object with its references as tuple
+        :rtype: (Collection, [str]) or [str]
+        """
+        if collection is not None:
+            text = collection
+        else:
+            text = self.get_collection(objectId)
+        reffs = self.chunk(
+            text,
+            lambda level: self.get_indexed_reffs(objectId, level=level, subreference=subreference)
+        )
+        if export_collection is True:
+            return text, reffs
+        return reffs
+
+    def get_indexed_reffs(self, objectId, level=1, subreference=None):
+        """ Retrieve a list of references from the citation index in the application database
+
+        Texts that are not in the index, or whose entries are older than their files, are answered by the resolver.
+
+        :param objectId: Collection Identifier
+        :type objectId: str
+        :param level: Depth of the references relative to subreference
+        :type level: int
+        :param subreference: Reference from which to retrieve children
+        :type subreference: str
+        :return: List of references
+        :rtype: [str]
+        """
+        version = self.resolver.text_version(objectId)
+        if version is not None and (subreference is None or (level == 1 and '-' not in subreference)) \
+                and self.has_citation_index():
+            query = CitationReff.query.filter_by(urn=objectId, version=version)
+            if subreference is None:
+                rows = query.filter_by(level=level)
+            else:
+                rows = query.filter_by(parent=subreference)
+            try:
+                reffs = [row.reff for row in rows.with_entities(CitationReff.reff).order_by(CitationReff.position)]
+                if reffs or query.first() is not None:
+                    return reffs
+            except SQLAlchemyError as E:
+                self.app.logger.warning("The citation index could not be read: %s", E)
+                db.session.rollback()
+        return self.resolver.getReffs(objectId, level=level, subreference=subreference)
+
+    def get_indexed_texts(self):
+        """ Retrieve the texts whose entries in the citation index are as recent as their files
+
+        :return: The identifiers of the texts
+        :rtype: {str}
+        """
+        if not self.has_citation_index():
+            return set()
+        try:
+            rows = CitationReff.query.with_entities(CitationReff.urn, CitationReff.version).distinct().all()
+        except SQLAlchemyError as E:
+            self.app.logger.warning("The citation index could not be read: %s", E)
+            db.session.rollback()
+            return set()
+        return {urn for urn, version in rows if version is not None and self.resolver.text_version(urn) == version}
+
+    def has_citation_index(self):
+        """ Whether the table of the citation index exists, e.g. if its migration has been run, so that the lookups do not
+        run a failing query each time it does not
+
+        :rtype: bool
+        """
+        if self.citation_index_exists is None:
+            try:
+                self.citation_index_exists = db.get_engine(self.app).has_table(CitationReff.__tablename__)
+            except SQLAlchemyError as E:
+                self.app.logger.warning("The citation index could not be found: %s", E)
+                self.citation_index_exists = False
+        return self.citation_index_exists
+
+    def get_indexed_reff_tree(self, objectId):
+        """ Retrieve the top-level references of a text with their children in a single query of the citation index
+
+        :param objectId: Collection Identifier
+        :type objectId: str
+        :return: List of the top-level references and their children or None if the text is not indexed
+        :rtype: [(str, [str])]
+        """
+        version = self.resolver.text_version(objectId)
+        if version is None or not self.has_citation_index():
+            return None
+        try:
+            rows = CitationReff.query.filter(CitationReff.urn == objectId, CitationReff.version == version,
+                                             CitationReff.level <= 2)\
+                .with_entities(CitationReff.level, CitationReff.reff, CitationReff.parent)\
+                .order_by(CitationReff.level, CitationReff.position).all()
+        except SQLAlchemyError:
+            db.session.rollback()
+            return None
+        if not rows:
+            return None
+        tree = OrderedDict()
+        for level, reff, parent in rows:
+            if level == 1:
+                tree[reff] = []
+            elif parent in tree:
+                tree[parent].append(reff)
+        return list(tree.items())
+
     def get_first_passage(self, objectId):
         """ Provides a redirect to the first passage of given objectId
 
@@ -286,11 +1070,52 @@ class NemoFormulae(Nemo):
         :type objectId: str
         :return: Redirection to the first passage of given text
         """
+        table = self.get_sibling_table(objectId)
+        if table is not None and table.first is not None:
+            return table.first
         collection, reffs = self.get_reffs(objectId=objectId, export_collection=True)
         first, _ = reffs[0]
         return str(first)
 
-    def r_passage(self, objectId, subreference, lang=None):
+    def get_sibling_table(self, objectId):
+        """ Retrieve the sibling table of a text, building it if the text has changed since it was built
+
+        :param objectId: Text identifier
+        :type objectId: str
+        :return: The table or None if the text has no version, e.g. with another resolver
+        :rtype: SiblingTable
+        """
+        version = getattr(self.resolver, 'text_version', lambda x: None)(objectId)
+        if version is None:
+            return None
+        entry = self.sibling_tables.get(objectId)
+        if entry is None or entry[0] != version:
+            text = self.get_collection(objectId)
+            if not text.readable or text.citation is None or len(text.citation) == 0:
+                return None
+            levels = [[str(reff) for reff in self.get_indexed_reffs(objectId, level=level)]
+                      for level in range(1, len(text.citation) + 1)]
+            chunks = [reff for reff, _ in self.chunk(text, lambda level: levels[level - 1])]
+            entry = (version, SiblingTable(levels, chunks))
+            self.sibling_tables.set(objectId, entry)
+        return entry[1]
+
+    def get_siblings(self, objectId, subreference, passage):
+        """ Get the previous and next passages of a passage from the sibling table of its text
+
+        :param objectId: Id of the object
+        :param subreference: Subreference of the object
+        :param passage: Current Passage, used if the subreference is not in the table
+        :return: Previous and next references
+        :rtype: (str, str)
+        """
+        table = self.get_sibling_table(objectId)
+        siblings = table.siblings(str(subreference)) if table is not None else None
+        if siblings is None:
+            return super(NemoFormulae, self).get_siblings(objectId, subreference, passage)
+        return siblings
+
+    def r_passage(self, objectId, subreference, lang=None, sents=None, parents=None):
         """ Retrieve the text of the passage
 
         :param objectId: Collection identifier
@@ -299,6 +1124,10 @@ class NemoFormulae(Nemo):
         :type lang: str
         :param subreference: Reference identifier
         :type subreference: str
+        :param sents: Sentences from elasticsearch results to highlight in the passage (see convert_result_sents)
+        :type sents: [str]
+        :param parents: The parents of the text if the caller has already built them (see make_parents)
+        :type parents: [dict]
         :return: Template, collections metadata and Markup object representing the text
         :rtype: {str: Any}
         """
@@ -315,13 +1144,9 @@ class NemoFormulae(Nemo):
         except IndexError:
             new_subref = self.get_reffs(objectId)[0][0]
             text = self.get_passage(objectId=objectId, subreference=new_subref)
-            flash('{}.{}'.format(collection.get_label(lang), subreference) + _l(' wurde nicht gefunden. Der ganze Text wird angezeigt.'))
+            self.flash('{}.{}'.format(collection.get_label(lang), subreference) + _l(' wurde nicht gefunden. Der ganze Text wird angezeigt.'))
             subreference = new_subref
-        passage = self.transform(text, text.export(Mimetypes.PYTHON.ETREE), objectId)
-        if 'notes' in self._transform:
-            notes = self.extract_notes(passage)
-        else:
-            notes = ''
+        passage, notes = self.render_passage(text, objectId, subreference, sents=sents)
         prev, next = self.get_siblings(objectId, subreference, text)
         # if current_user.project_team is False and str(text.get_creator(lang)) not in self.OPEN_COLLECTIONS:
         #     pdf_path = self.pdf_folder + objectId.split(':')[-1] + '.pdf'
@@ -342,7 +1167,7 @@ class NemoFormulae(Nemo):
                     "coins": self.make_coins(collection, text, subreference, lang=lang),
                     'lang': collection.lang
                 },
-                "parents": self.make_parents(collection, lang=lang)
+                "parents": parents if parents is not None else self.make_parents(collection, lang=lang)
             },
             "text_passage": Markup(passage),
             "notes": Markup(notes),
@@ -353,6 +1178,56 @@ class NemoFormulae(Nemo):
             "date": "{:04}-{:02}-{:02}".format(date.today().year, date.today().month, date.today().day)
         }
 
+    def flash(self, message):
+        """ Flash a message or, in a passage thread, keep it to be flashed by the request thread (see passage_task)
+
+        :param message: The message
+        :type message: str
+        """
+        messages = getattr(self.passage_messages, 'messages', None)
+        if messages is None:
+            flash(message)
+        else:
+            messages.append(message)
+
+    def passage_task(self, func):
+        """ Wrap a function to run in a thread of the passage executor with a copy of the request context
+
+        The task returns the messages flashed by the function with its result so that the request thread flashes them
+        (see passage_results). Before Flask 1.1, the copy of the request context loads its own session, in which the
+        messages would be lost.
+
+        :param func: The function
+        :type func: function
+        :return: The task, returning the result of func and its messages
+        :rtype: function
+        """
+        func = copy_current_request_context(func)
+
+        def task(*args, **kwargs):
+            self.passage_messages.messages = []
+            try:
+                return func(*args, **kwargs), self.passage_messages.messages
+            finally:
+                self.passage_messages.messages = None
+        return task
+
+    def passage_results(self, futures):
+        """ Wait for the passage tasks and flash their messages in the request thread, in the order of the tasks
+
+        :param futures: The futures of the tasks submitted by passage_task
+        :type futures: [concurrent.futures.Future]
+        :return: The results of the tasks
+        :rtype: [Any]
+        """
+        results = []
+        for future in futures:
+            result, messages = future.result()
+            for message in messages:
+                flash(message)
+            results.append(result)
+        return results
+
     def r_multipassage(self, objectIds, subreferences, lang=None, result_sents=''):
         """ Retrieve the text of the passage
 
@@ -368,24 +1243,26 @@ class NemoFormulae(Nemo):
         :rtype: {str: Any}
         """
         ids = objectIds.split('+')
-        translations = {}
-        for i in ids:
-            p = self.resolver.getMetadata(self.resolver.getMetadata(i).parent.id)
-            translations[i] = [m for m in p.readableDescendants if m.id not in ids]
+        translations = {i: self.get_versions(i, exclude=ids) for i in ids}
         passage_data = {'template': 'main::multipassage.html', 'objects': [], "translation": translations}
         subrefers = subreferences.split('+')
         result_sents = request.args.get('result_sents')
-        for i, id in enumerate(ids):
-            if subrefers[i] in ["all", 'first']:
+        sents = self.convert_result_sents(result_sents) if result_sents else None
+
+        def get_passage_data(id, subref):
+            if subref in ["all", 'first']:
                 subref = self.get_reffs(id)[0][0]
-            else:
-                subref = subrefers[i]
-            d = self.r_passage(id, subref, lang=lang)
+            d = self.r_passage(id, subref, lang=lang, sents=sents)
             del d['template']
-            if result_sents:
-                d['text_passage'] = self.highlight_found_sents(d['text_passage'],
-                                                               self.convert_result_sents(result_sents))
-            passage_data['objects'].append(d)
+            return d
+
+        if len(ids) > 1 and self.passage_workers > 1:
+            # The passages are retrieved and transformed concurrently, each thread in a copy of the request context
+            futures = [self.passage_executor.submit(self.passage_task(get_passage_data), id, subrefers[i])
+                       for i, id in enumerate(ids)]
+            passage_data['objects'] = self.passage_results(futures)
+        else:
+            passage_data['objects'] = [get_passage_data(id, subrefers[i]) for i, id in enumerate(ids)]
         if len(ids) > len(passage_data['objects']):
             flash(_('Mindestens ein Text, den Sie anzeigen möchten, ist nicht verfügbar.'))
         return passage_data
@@ -404,21 +1281,103 @@ class NemoFormulae(Nemo):
         :return: Template, collections metadata and Markup object representing the text
         :rtype: {str: Any}
         """
-        def split_comms(com):
-            ident = ':'.join(com.split(':')[:-1]).replace('greekLit', 'cjhnt')
-            ref = com.split(':')[-1]
-            return {'id': ident, 'ref': ref}
-
-        comms = [split_comms(x.com) for x in NtComRels.query.filter_by(nt=objectIds + ':' + subreferences).all()]
-        passage_data = {'template': 'main::commentary_view.html', 'comm_sections': [], "nt": self.r_passage(objectIds,
-                                                                                                            subreferences,
-                                                                                                            lang=lang)}
+        comms = [self.split_commentary(x) for x in self.get_commentary_index().get_commentaries(objectIds + ':' + subreferences)]
+        # The parents are the same for all the sections of a commentary and so are only built once
+        parents = {}
         for com in comms:
-            d = self.r_passage(com['id'], com['ref'], lang=lang)
+            if com['id'] not in parents:
+                collection = self.get_collection(com['id'])
+                parents[com['id']] = None if isinstance(collection, CtsWorkMetadata) else self.make_parents(collection,
+                                                                                                          lang=lang)
+        self.add_surrogate_keys(*parents)
+        passages = [(objectIds, subreferences, None)] + [(com['id'], com['ref'], parents[com['id']]) for com in comms]
+        if len(passages) > 1 and self.passage_workers > 1:
+            # The NT passage and the sections are retrieved and transformed concurrently, as in r_multipassage
+            futures = [self.passage_executor.submit(self.passage_task(self.r_passage), id, subref,
+                                                    lang=lang, parents=p) for id, subref, p in passages]
+            data = self.passage_results(futures)
+        else:
+            data = [self.r_passage(id, subref, lang=lang, parents=p) for id, subref, p in passages]
+        for d in data[1:]:
             del d['template']
-            passage_data['comm_sections'].append(d)
+        passage_data = {'template': 'main::commentary_view.html', 'comm_sections': data[1:], "nt": data[0]}
+        if self.prefetch_commentaries:
+            for subref in (data[0]['prev'], data[0]['next']):
+                if subref is not None:
+                    self.submit_prefetch(objectIds, subref)
         return passage_data
 
+    @staticmethod
+    def split_commentary(com):
+        """ Split a commentary section of the NT-commentary relations into the identifier of its text and its reference
+
+        :param com: The commentary section, e.g. urn:cts:greekLit:tlg0042.tlg006.opp-grc1:1
+        :type com: str
+        :return: The identifier and the reference
+        :rtype: {str: str}
+        """
+        ident = ':'.join(com.split(':')[:-1]).replace('greekLit', 'cjhnt')
+        ref = com.split(':')[-1]
+        return {'id': ident, 'ref': ref}
+
+    def submit_prefetch(self, objectId, subreference):
+        """ Prefetch an NT passage and its commentary sections on the prefetch thread unless two prefetches are already
+        queued or running, in which case it is dropped
+
+        :param objectId: The identifier of the NT text
+        :type objectId: str
+        :param subreference: The NT passage
+        :type subreference: str
+        :return: Whether the prefetch was submitted
+        :rtype: bool
+        """
+        if not self.prefetch_slots.acquire(blocking=False):
+            return False
+        prefetch = copy_current_request_context(self.prefetch_commentary)
+
+        def run():
+            try:
+                prefetch(objectId, subreference)
+            finally:
+                self.prefetch_slots.release()
+
+        try:
+            self.prefetch_executor.submit(run)
+        except RuntimeError:
+            self.prefetch_slots.release()
+            return False
+        return True
+
+    def prefetch_commentary(self, objectId, subreference):
+        """ Render an NT passage and the commentary sections on it into the passage cache, e.g. in the background for
+        the passages next to the one being read
+
+        The commentaries are resolved to the texts and editions that r_passage renders so that their cache keys match.
+
+        :param objectId: The identifier of the NT text
+        :type objectId: str
+        :param subreference: The NT passage
+        :type subreference: str
+        """
+        passages = [(objectId, subreference)] + [
+            (com['id'], com['ref']) for com in map(self.split_commentary, self.get_commentary_index().get_commentaries(
+                objectId + ':' + subreference))
+        ]
+        for id, subref in passages:
+            try:
+                collection = self.get_collection(id)
+                if isinstance(collection, CtsWorkMetadata):
+                    editions = [t for t in collection.children.values() if isinstance(t, CtsEditionMetadata)]
+                    if len(editions) == 0:
+                        continue
+                    id = editions[0].id
+                key = self.passage_cache_key(id, subref)
+                if key is None or self.passage_cache.has(key):
+                    continue
+                self.render_passage(self.get_passage(objectId=id, subreference=subref), id, subref)
+            except Exception as E:
+                self.app.logger.warning("%s:%s could not be prefetched: %s", id, subref, E)
+
     def convert_result_sents(self, sents):
         """ Remove extraneous markup and punctuation from the result_sents returned from the search page
 
@@ -429,7 +1388,7 @@ class NemoFormulae(Nemo):
         intermediate = re.sub('strong|small', '', intermediate)
         intermediate = re.sub('\s+', ' ', intermediate)
         intermediate = intermediate.split('$')
-        return [re.sub('[{}„“…]'.format(punctuation), '', x) for x in intermediate]
+        return [self.PUNCTUATION.sub('', x) for x in intermediate]
 
     def highlight_found_sents(self, html, sents):
         """ Adds "searched" to the classList of words in "sents" from elasticsearch results
@@ -438,26 +1397,59 @@ class NemoFormulae(Nemo):
         :param sents: list of the "sents" strings
         :return: transformed html
         """
-        root = etree.fromstring(html)
+        root = etree.fromstring(html) if isinstance(html, str) else html
+        self.mark_found_sents(root, sents)
+        return Markup(self.serialize_highlighted(root))
+
+    def mark_found_sents(self, root, sents):
+        """ Adds "searched-start" and "searched-end" to the classList of the first and last words of "sents" in a tree
+
+        :param root: the root element of the transformed passage, which is changed in place
+        :type root: etree._Element
+        :param sents: list of the "sents" strings
+        :type sents: [str]
+        """
         spans = root.xpath('//span[contains(@class, "w")]')
-        texts = [re.sub('[{}„“…]'.format(punctuation), '', re.sub(r'&[lg]t;', '', x.text)) for x in spans if re.sub('[{}„“…]'.format(punctuation), '', x.text) != '']
-        for sent in sents:
-            words = sent.split()
-            for i in range(len(spans)):
-                if words == texts[i:i + len(words)]:
-                    spans[i].set('class', spans[i].get('class') + ' searched-start')
-                    spans[i + len(words) - 1].set('class', spans[i + len(words) - 1].get('class') + ' searched-end')
-                    for span in spans[i:i + len(words)]:
-                        if span.getparent().index(span) == 0 and 'searched-start' not in span.get('class'):
-                            span.set('class', span.get('class') + ' searched-start')
-                        if span == span.getparent().findall('span')[-1] and 'searched-end' not in span.get('class'):
-                            span.set('class', span.get('class') + ' searched-end')
-                    break
-        xml_string = etree.tostring(root, encoding=str, method='html', xml_declaration=None, pretty_print=False,
-                                    with_tail=True, standalone=None)
+        # The words of the passage without punctuation and the spans they come from, skipping punctuation-only spans
+        positions = []
+        texts = []
+        for position, span in enumerate(spans):
+            text = span.text or ''
+            if self.PUNCTUATION.sub('', text) != '':
+                positions.append(position)
+                texts.append(self.PUNCTUATION.sub('', re.sub(r'&[lg]t;', '', text)))
+        starts = set()
+        ends = set()
+        for start, end in SentenceMatcher([sent.split() for sent in sents]).find(texts).values():
+            start, end = positions[start], positions[end]
+            starts.add(start)
+            ends.add(end)
+            # The highlighting is split where the sentence crosses the boundary of a parent node
+            for position in range(start, end + 1):
+                span = spans[position]
+                if span.getprevious() is None:
+                    starts.add(position)
+                if next(span.itersiblings('span'), None) is None:
+                    ends.add(position)
+        for position in sorted(starts | ends):
+            classes = [spans[position].get('class')]
+            if position in starts:
+                classes.append('searched-start')
+            if position in ends:
+                classes.append('searched-end')
+            spans[position].set('class', ' '.join(classes))
+
+    def serialize_highlighted(self, root):
+        """ Serializes a tree marked by mark_found_sents, wrapping each found sentence in a "searched" span
+
+        :param root: the root element of the transformed passage
+        :type root: etree._Element
+        :return: the html
+        :rtype: str
+        """
+        xml_string = self.serialize_passage(root.getroottree())
         span_pattern = re.compile(r'(<span class="w \w*\s?searched-start.*?searched-end".*?</span>)', re.DOTALL)
-        xml_string = re.sub(span_pattern, r'<span class="searched">\1</span>', xml_string)
-        return Markup(xml_string)
+        return re.sub(span_pattern, r'<span class="searched">\1</span>', xml_string)
 
     def r_impressum(self):
         """ Impressum route function
@@ -467,6 +1459,161 @@ class NemoFormulae(Nemo):
         """
         return {"template": "main::impressum.html"}
 
+    def fragment_key(self, objectId, subreference):
+        """ The key of a rendered passage in the fragment store
+
+        The key contains the version of the textgroup of the text, so that the passages of a text are invalidated when
+        the text changes, and the modification time of the XSL stylesheet, so that they are when the stylesheet does.
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param subreference: Reference identifier
+        :type subreference: str
+        :return: The key or None if the passage should not be stored
+        :rtype: str
+        """
+        version = getattr(self.resolver, 'text_version', lambda x: None)(objectId)
+        if version is None:
+            return None
+        transform = str(objectId) if str(objectId) in self._transform else 'default'
+        xsl = self._transform[transform]
+        if isinstance(xsl, str):
+            transform = '{}@{}'.format(transform, os.stat(xsl).st_mtime_ns)
+        return '|'.join(['passage', objectId, str(subreference), transform, version])
+
+    def passage_cache_key(self, objectId, subreference):
+        """ The key of a rendered passage in the passage cache, i.e. its fragment key and the locale
+
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param subreference: Reference identifier
+        :type subreference: str
+        :return: The key or None if the passage should not be cached
+        :rtype: str
+        """
+        key = self.fragment_key(objectId, subreference)
+        if key is None:
+            return None
+        return '|'.join([key, self.get_locale()])
+
+    def render_passage(self, text, objectId, subreference, sents=None):
+        """ Transform a passage and extract its notes or retrieve them from the fragment store or the passage cache
+
+        The transformed passage is kept as a tree from which the notes are extracted and in which the found sentences
+        are highlighted, so that it is serialized only once. Highlighted passages are not cached.
+
+        :param text: The passage
+        :type text: CapitainsCtsPassage
+        :param objectId: Collection identifier
+        :type objectId: str
+        :param subreference: Reference identifier
+        :type subreference: str
+        :param sents: Sentences to highlight in the passage
+        :type sents: [str]
+        :return: The transformed passage and its notes
+        :rtype: (str, str)
+        """
+        rendered = None
+        key = self.passage_cache_key(objectId, subreference)
+        if key is not None:
+            if self.fragments is not None:
+                rendered = self.fragments.get(self.fragment_key(objectId, subreference))
+            if rendered is None:
+                rendered = self.passage_cache.get(key)
+        if rendered is not None:
+            if sents:
+                return Markup(self.highlight_found_sents(rendered[0], sents)), rendered[1]
+            return rendered
+        tree = self.transform_tree(text, text.export(Mimetypes.PYTHON.ETREE), objectId)
+        notes = self.extract_notes(tree) if 'notes' in self._transform else ''
+        if sents:
+            root = tree.getroot()
+            self.mark_found_sents(root, sents)
+            return Markup(self.serialize_highlighted(root)), notes
+        rendered = (self.serialize_passage(tree), notes)
+        if key is not None:
+            self.passage_cache.set(key, rendered)
+        return rendered
+
+    def transform(self, work, xml, objectId, subreference=None):
+        """ Transform input according to potentially registered XSLT
+
+        XSL stylesheets are taken from the compiled stylesheets of self.xslt instead of being compiled on every call.
+
+        :param work: Work object containing metadata about the xml
+        :type work: MyCapytains.resources.inventory.Text
+        :param xml: XML to transform
+        :type xml: etree._Element
+        :param objectId: Object Identifier
+        :type objectId: str
+        :param subreference: Subreference
+        :type subreference: str
+        :return: String representation of transformed resource
+        :rtype: str
+        """
+        func = self._transform.get(str(objectId), self._transform["default"])
+        if isinstance(func, str):
+            return self.serialize_passage(self.xslt.get(func)(xml))
+        return super(NemoFormulae, self).transform(work, xml, objectId, subreference=subreference)
+
+    def prerender_text(self, objectId):
+        """ Render every citation unit of a text, and the groups of them that the reference lists link to, to the
+        fragment store unless they have already been rendered for the current version of the text
+
+        :param objectId: The identifier of the text
+        :type objectId: str
+        :return: The files of the fragments of the text
+        :rtype: [str]
+        """
+        text = self.resolver.getMetadata(objectId)
+        subreferences = []
+        for level in range(1, len(text.citation) + 1):
+            subreferences += [str(reff) for reff in self.resolver.getReffs(objectId, level=level)]
+        subreferences += [reff for reff, label in self.chunk(
+            text, lambda level: self.resolver.getReffs(objectId, level=level))]
+        paths = []
+        for subreference in OrderedDict.fromkeys(subreferences):
+            key = self.fragment_key(objectId, subreference)
+            if key is None:
+                continue
+            path = self.fragments.path(key)
+            if key not in self.fragments:
+                passage = self.get_passage(objectId=objectId, subreference=subreference)
+                tree = self.transform_tree(passage, passage.export(Mimetypes.PYTHON.ETREE), objectId)
+                notes = self.extract_notes(tree) if 'notes' in self._transform else ''
+                self.fragments.set(key, self.serialize_passage(tree), notes)
+            paths.append(path)
+        return paths
+
+    def transform_tree(self, work, xml, objectId, subreference=None):
+        """ Transform input like transform but return the resulting tree instead of its serialization
+
+        :param work: Work object containing metadata about the xml
+        :type work: MyCapytains.resources.inventory.Text
+        :param xml: XML to transform
+        :type xml: etree._Element
+        :param objectId: Object Identifier
+        :type objectId: str
+        :param subreference: Subreference
+        :type subreference: str
+        :return: The transformed resource
+        :rtype: etree._ElementTree
+        """
+        func = self._transform.get(str(objectId), self._transform["default"])
+        if isinstance(func, str):
+            return self.xslt.get(func)(xml)
+        return etree.ElementTree(etree.fromstring(self.transform(work, xml, objectId, subreference=subreference)))
+
+    def serialize_passage(self, tree):
+        """ Serialize a transformed passage to html
+
+        :param tree: The transformed passage
+        :type tree: etree._ElementTree
+        :rtype: str
+        """
+        return etree.tostring(tree, encoding=str, method="html", xml_declaration=None, pretty_print=False,
+                              with_tail=True, standalone=None)
+
     def extract_notes(self, text):
         """ Constructs a dictionary that contains all notes with their ids. This will allow the notes to be
         rendered anywhere on the page and not only where they occur in the text.
@@ -474,10 +1621,10 @@ class NemoFormulae(Nemo):
         :param text: the string to be transformed
         :return: dict('note_id': 'note_content')
         """
-        with open(self._transform['notes']) as f:
-            xslt = etree.XSLT(etree.parse(f))
-
-        return str(xslt(etree.fromstring(text)))
+        xslt = self.xslt.get(self._transform['notes'])
+        if isinstance(text, str):
+            text = etree.fromstring(text)
+        return str(xslt(text))
 
     ''' I may add these back in later.
     def r_add_sub_elements(self, coll, objectIds, reffs, lang=None):
@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import mmap
+import os
+import tempfile
+
+
+class FragmentStore(object):
+    """ Passages rendered ahead of time, e.g. by the prerender manager command, as files in a folder
+
+    Every fragment is stored under the sha1 digest of its key (see NemoFormulae.fragment_key), which contains the version
+    of the text and of the XSL stylesheet. So a fragment never has to be invalidated: a changed text or stylesheet is
+    simply looked up at another address. The files hold the passage and its notes separated by a NUL byte, which cannot
+    occur in XML, and are memory-mapped when they are read.
+
+    :param folder: The folder of the fragments
+    :type folder: str
+    """
+    SEPARATOR = b'\0'
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, key):
+        """ The file of a fragment
+
+        :param key: The key of the fragment
+        :type key: str
+        :rtype: str
+        """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest[2:] + '.html')
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key):
+        """ Read a fragment
+
+        :param key: The key of the fragment
+        :type key: str
+        :return: The passage and its notes or None if the fragment has not been rendered
+        :rtype: (str, str)
+        """
+        try:
+            with open(self.path(key), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                separator = m.find(self.SEPARATOR)
+                if separator == -1:
+                    return None
+                return m[:separator].decode('utf-8'), m[separator + 1:].decode('utf-8')
+        except (OSError, ValueError):
+            # ValueError is raised when mapping an empty file
+            return None
+
+    def set(self, key, passage, notes):
+        """ Write a fragment atomically
+
+        :param key: The key of the fragment
+        :type key: str
+        :param passage: The transformed passage
+        :type passage: str
+        :param notes: The notes of the passage
+        :type notes: str
+        :return: The file of the fragment
+        :rtype: str
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(passage.encode('utf-8') + self.SEPARATOR + notes.encode('utf-8'))
+        os.replace(tmp, path)
+        return path
+
+    def prune(self, keep):
+        """ Remove the fragments that are not in keep, e.g. those of old versions of the texts
+
+        :param keep: The files of the fragments to keep
+        :type keep: {str}
+        :return: The number of removed fragments
+        :rtype: int
+        """
+        removed = 0
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                if path not in keep:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+# The NemoFormulae instance used by the processes of prerender. They are forked and so inherit it.
+_nemo = None
+
+
+def _prerender_text(objectId):
+    return _nemo.prerender_text(objectId)
+
+
+def prerender(nemo, objectIds, workers=1):
+    """ Render the passages of texts to the fragment store of nemo in workers processes
+
+    :param nemo: The Nemo instance whose fragments are rendered
+    :type nemo: NemoFormulae
+    :param objectIds: The identifiers of the texts
+    :type objectIds: [str]
+    :param workers: The number of processes
+    :type workers: int
+    :return: The files of the fragments of the texts
+    :rtype: [str]
+    """
+    global _nemo
+    _nemo = nemo
+    try:
+        if workers > 1 and len(objectIds) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                paths = list(executor.map(_prerender_text, objectIds))
+        else:
+            paths = [_prerender_text(objectId) for objectId in objectIds]
+    finally:
+        _nemo = None
+    return [path for text_paths in paths for path in text_paths]
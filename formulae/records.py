@@ -0,0 +1,116 @@
+from types import MappingProxyType
+import sys
+
+
+class MemberRecord(object):
+    """ Compact, read-only record of a collection or text as built by Nemo.make_members
+
+    Records are read like the member dictionaries they replace, i.e. record.label or record['label']. Their strings are
+    interned so that identifiers and labels repeated over the languages of the catalogue are only kept once.
+
+    :param values: The values of FIELDS in order
+    """
+    __slots__ = ('id', 'label', 'model', 'type', 'size', 'semantic', 'lang', 'short_title', 'parent')
+    FIELDS = __slots__
+    # Fields that are only set for some members and that are missing from their dictionaries otherwise
+    OPTIONAL = ('lang', 'short_title', 'parent')
+
+    def __init__(self, *values):
+        for field, value in zip(self.FIELDS, values):
+            object.__setattr__(self, field, sys.intern(value) if isinstance(value, str) else value)
+
+    @classmethod
+    def from_member(cls, member, **kwargs):
+        """ Build a record from a member dictionary
+
+        :param member: The dictionary built by make_members
+        :type member: dict
+        :param kwargs: Values of fields that are not in member
+        :return: The record
+        :rtype: MemberRecord
+        """
+        member = dict(member, **kwargs)
+        return cls(*[member.get(field) for field in cls.FIELDS])
+
+    def values(self):
+        """ The values of FIELDS in order, e.g. to serialize the record
+
+        :rtype: [Any]
+        """
+        return [getattr(self, field) for field in self.FIELDS]
+
+    def keys(self):
+        return [field for field in self.FIELDS if field not in self.OPTIONAL or getattr(self, field) is not None]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS or (key in self.OPTIONAL and getattr(self, key) is None):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __setattr__(self, key, value):
+        raise AttributeError('{} is read-only'.format(type(self).__name__))
+
+    def __eq__(self, other):
+        return isinstance(other, MemberRecord) and self.values() == other.values()
+
+    def __hash__(self):
+        return hash(tuple(self.values()))
+
+    def __reduce__(self):
+        return type(self), tuple(self.values())
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.id)
+
+
+class Catalogue(object):
+    """ The records of one language of the sub-collection catalogue
+
+    :param members: dictionary with the collection identifiers as keys and the values of the records of their members
+        as values
+    :type members: {str: [[Any]]}
+
+    :ivar members: The records of the members of every collection, by collection identifier
+    :ivar records: The record of every collection and text, by identifier
+    """
+    __slots__ = ('members', 'records')
+
+    def __init__(self, members):
+        records = {}
+        frozen = {}
+        for collection, values in members.items():
+            for v in values:
+                if v[0] not in records:
+                    records[v[0]] = MemberRecord(*v)
+            frozen[sys.intern(collection)] = tuple(records[v[0]] for v in values)
+        self.members = MappingProxyType(frozen)
+        self.records = MappingProxyType(records)
+
+    def parents(self, record):
+        """ The records of the ancestors of a record, from the closest to the furthest, as built by Nemo.make_parents
+
+        :param record: The record
+        :type record: MemberRecord
+        :rtype: [MemberRecord]
+        """
+        parents = []
+        parent = self.records.get(record.parent)
+        while parent is not None:
+            parents.append(parent)
+            parent = self.records.get(parent.parent)
+        return parents
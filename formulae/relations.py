@@ -0,0 +1,127 @@
+from bisect import bisect_right
+import re
+
+# The reference parts are compared by their number and then by the rest, e.g. "5" < "5a" < "6"
+REFERENCE_PART = re.compile(r'(\d*)(.*)')
+# Sorts after every part of a reference, so that the end of the range "1" is after "1.1", "1.2", etc.
+END = (float('inf'), '')
+
+
+def reference_part(part):
+    """ The sort key of a part of a reference
+
+    :param part: The part, e.g. "5" or "5a"
+    :type part: str
+    :rtype: (int, str)
+    """
+    number, rest = REFERENCE_PART.match(part).groups()
+    return int(number) if number else -1, rest
+
+
+def split_passage(urn):
+    """ Split a passage identifier into its text and the interval of the references it covers
+
+    :param urn: The identifier, e.g. "urn:cts:cjhnt:nt.86-Jud.grc001:1.1-1.20" or "urn:cts:cjhnt:nt.86-Jud.grc001:1"
+    :type urn: str
+    :return: The text identifier and the sort keys of the start and of the end of the interval
+    :rtype: (str, tuple, tuple)
+    """
+    text, reference = urn.rsplit(':', 1)
+    start, _, end = reference.partition('-')
+    start = tuple(reference_part(part) for part in start.split('.'))
+    end = tuple(reference_part(part) for part in (end or reference).split('.')) + (END,)
+    return text, start, end
+
+
+class IntervalIndex(object):
+    """ The reference intervals of the passages of every text, each with a value, queried by overlap
+
+    The intervals of a text are sorted by their start. Together with the greatest end among the intervals up to each
+    position, this finds the intervals overlapping a query with a binary search and a scan that stops as soon as no
+    earlier interval can reach the query.
+
+    :param entries: The passage identifiers and their values
+    :type entries: [(str, Any)]
+    """
+
+    def __init__(self, entries):
+        intervals = {}
+        for order, (urn, value) in enumerate(entries):
+            try:
+                text, start, end = split_passage(urn)
+            except ValueError:
+                continue
+            intervals.setdefault(text, []).append((start, end, order, value))
+        self.texts = {}
+        for text, entries in intervals.items():
+            entries.sort(key=lambda entry: (entry[0], entry[2]))
+            max_ends = []
+            for entry in entries:
+                max_ends.append(max(max_ends[-1], entry[1]) if max_ends else entry[1])
+            self.texts[text] = ([entry[0] for entry in entries], max_ends, entries)
+
+    def __len__(self):
+        return sum(len(entries) for starts, max_ends, entries in self.texts.values())
+
+    def overlapping(self, urn):
+        """ The values of the passages whose references overlap those of a passage, in the order of the entries
+
+        :param urn: The passage identifier
+        :type urn: str
+        :rtype: [Any]
+        """
+        try:
+            text, start, end = split_passage(urn)
+        except ValueError:
+            return []
+        if text not in self.texts:
+            return []
+        starts, max_ends, entries = self.texts[text]
+        found = []
+        for position in range(bisect_right(starts, end) - 1, -1, -1):
+            if max_ends[position] < start:
+                break
+            if entries[position][1] >= start:
+                found.append(entries[position])
+        found.sort(key=lambda entry: entry[2])
+        values = []
+        for entry in found:
+            if entry[3] not in values:
+                values.append(entry[3])
+        return values
+
+
+class CommentaryIndex(object):
+    """ The relations between the passages of the New Testament and the sections of the commentaries, in both directions
+
+    :param relations: The NT passage and commentary section identifiers of the relations
+    :type relations: [(str, str)]
+    :param version: The version of the relations, e.g. the modification time of the database they were read from
+    """
+
+    def __init__(self, relations, version=None):
+        relations = list(relations)
+        self.version = version
+        self.commentaries = IntervalIndex(relations)
+        self.nt = IntervalIndex([(com, nt) for nt, com in relations])
+
+    def __len__(self):
+        return len(self.commentaries)
+
+    def get_commentaries(self, urn):
+        """ The commentary sections on an NT passage
+
+        :param urn: The NT passage, e.g. "urn:cts:cjhnt:nt.86-Jud.grc001:1.5"
+        :type urn: str
+        :rtype: [str]
+        """
+        return self.commentaries.overlapping(urn)
+
+    def get_nt_passages(self, urn):
+        """ The NT passages that a commentary section comments on
+
+        :param urn: The commentary section
+        :type urn: str
+        :rtype: [str]
+        """
+        return self.nt.overlapping(urn)
@@ -0,0 +1,687 @@
+from capitains_nautilus.cts.resolver import NautilusCTSResolver
+from capitains_nautilus.errors import UndispatchedTextError
+from capitains_nautilus import _cache_key
+import MyCapytain.errors
+from MyCapytain.common.constants import set_graph, XPATH_NAMESPACES
+from MyCapytain.common.reference import URN, Reference
+from MyCapytain.common.utils import xmlparser
+from MyCapytain.resources.collections.cts import XmlCtsTextgroupMetadata as TextGroup, \
+    XmlCtsWorkMetadata as Work, XmlCtsCitation as Citation
+from MyCapytain.resources.texts.local.capitains.cts import CapitainsCtsText as Text
+from .cache import TwoTierCache, BoundedMemoryCache
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from time import time
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+
+def corpus_fingerprint(folders):
+    """ Computes a content hash for every textgroup folder in the corpus
+
+    :param folders: The corpus folders (i.e., CORPUS_FOLDERS)
+    :type folders: [str]
+    :return: dictionary with the textgroup folders as keys and the sha1 hex digest of their XML files as values
+    :rtype: {str: str}
+    """
+    fingerprint = {}
+    for folder in folders:
+        for __cts__ in glob("{base_folder}/data/*/__cts__.xml".format(base_folder=folder)):
+            textgroup = os.path.dirname(__cts__)
+            fingerprint[textgroup] = textgroup_digest(textgroup)
+    return fingerprint
+
+
+def textgroup_digest(textgroup):
+    """ Computes the content hash of a textgroup folder
+
+    :param textgroup: The textgroup folder, i.e. {corpus folder}/data/{textgroup}
+    :type textgroup: str
+    :return: The sha1 hex digest of the paths and contents of the XML files in the folder
+    :rtype: str
+    """
+    folder = os.path.dirname(os.path.dirname(textgroup))
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(textgroup):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith('.xml'):
+                continue
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, folder).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def corpus_stats(folders):
+    """ Cheaply summarizes the XML files of every textgroup folder in the corpus to find the folders that may have
+    changed without reading their files
+
+    :param folders: The corpus folders (i.e., CORPUS_FOLDERS)
+    :type folders: [str]
+    :return: dictionary with the textgroup folders as keys and the number, total size and latest modification time of
+        their XML files as values
+    :rtype: {str: (int, int, int)}
+    """
+    stats = {}
+    for folder in folders:
+        for __cts__ in glob("{base_folder}/data/*/__cts__.xml".format(base_folder=folder)):
+            textgroup = os.path.dirname(__cts__)
+            count, size, mtime = 0, 0, 0
+            for root, dirs, files in os.walk(textgroup):
+                for name in files:
+                    if not name.endswith('.xml'):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    count += 1
+                    size += stat.st_size
+                    mtime = max(mtime, stat.st_mtime_ns)
+            stats[textgroup] = (count, size, mtime)
+    return stats
+
+
+def corpus_version(fingerprint):
+    """ Combines the textgroup hashes of a corpus fingerprint into a single corpus version
+
+    :param fingerprint: The output of corpus_fingerprint
+    :type fingerprint: {str: str}
+    :return: sha1 hex digest identifying the current state of the corpus
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    for textgroup, textgroup_digest in sorted(fingerprint.items()):
+        digest.update(textgroup_digest.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def parse_citation(path):
+    """ Reads the citation scheme of a TEI file
+
+    This is a module-level function so that it can be run in the worker processes of the corpus parsing.
+
+    :param path: The path of the TEI file
+    :type path: str
+    :return: (xpath, scope, name) for every citation level from the top down or None if the file could not be parsed
+    :rtype: [(str, str, str)]
+    """
+    try:
+        with open(path) as f:
+            text = Text(resource=xmlparser(f))
+        return [(cite.xpath, cite.scope, cite.name) for cite in text.citation]
+    except Exception:
+        return None
+
+
+def reff_tree(node, citations, parent=None):
+    """ Build the reference tree of the part of a TEI document below a node
+
+    :param node: The document root or the node of the parent reference
+    :type node: etree._Element
+    :param citations: The citations of the levels below node, the first being that of its children
+    :type citations: [XmlCtsCitation]
+    :param parent: The reference of node, if it is not the root
+    :type parent: str
+    :return: The references of the children of node, each with the tree of its own children if there are more levels
+    :rtype: [(str, list)] or [str]
+    """
+    citation = citations[0]
+    if parent is None:
+        xpath = citation.fill(None)
+    else:
+        xpath = '.' + citation.fill(None, xpath=True)
+    attribute = citation.attribute.replace("xml:", "{http://www.w3.org/XML/1998/namespace}")
+    tree = []
+    for child in node.xpath(xpath, namespaces=XPATH_NAMESPACES):
+        reff = child.get(attribute)
+        if parent is not None:
+            reff = parent + '.' + reff
+        if len(citations) > 1:
+            tree.append((reff, reff_tree(child, citations[1:], parent=reff)))
+        else:
+            tree.append(reff)
+    return tree
+
+
+def build_citation(levels):
+    """ Builds the citation object of a text from the output of parse_citation
+
+    :param levels: (xpath, scope, name) for every citation level from the top down
+    :type levels: [(str, str, str)]
+    :return: The top citation level
+    :rtype: Citation
+    """
+    citation = None
+    for xpath, scope, name in levels[::-1]:
+        citation = Citation(xpath=xpath.replace("'", '"'), scope=scope.replace("'", '"'), name=name, child=citation)
+    return citation
+
+
+class FormulaeCTSResolver(NautilusCTSResolver):
+    """ NautilusCTSResolver that keeps a versioned snapshot of the parsed inventory on disk
+
+    The snapshot contains the dispatched inventory (collections, editions and citation schemes) and is keyed by the
+    content hash of the corpus folders. It is loaded instead of parsing the corpus as long as no file has changed and
+    it is rebuilt automatically when one has. The namespace of a TwoTierCache is set to the corpus version so that
+    cached metadata, references and passages of an older version of the corpus are never served. The cache keys of
+    textgroups, works and texts also contain the hash of their textgroup folder so that, when reload re-parses the
+    textgroups that have changed, only their entries are invalidated.
+    The hashes are saved in the snapshot folder with the corpus_stats of their textgroups, so that a worker only reads
+    the files of the textgroups whose number, size or modification time of XML files has changed since.
+
+    :param resource: The corpus folders
+    :type resource: [str]
+    :param snapshot_folder: Folder in which the inventory snapshots are saved. If None, no snapshot is used.
+    :type snapshot_folder: str
+    :param fingerprint: Pre-computed corpus fingerprint. If None, it is taken from the saved fingerprint for the
+        textgroups that have not changed and computed from resource for the others.
+    :type fingerprint: {str: str}
+    :param workers: Number of processes reading the citation schemes of the TEI files when the corpus is parsed
+    :type workers: int
+    :param text_cache_items: Maximum number of parsed TEI texts kept in memory. 0 means no limit.
+    :type text_cache_items: int
+    :param text_cache_bytes: Maximum estimated memory in bytes taken by the parsed TEI texts. 0 means no limit.
+    :type text_cache_bytes: int
+
+    :ivar corpus_version: Hash identifying the current state of the corpus
+    :ivar stats: The corpus_stats of the corpus when its fingerprint was computed
+    :ivar snapshot_time: Time stamp of the parsing of the current inventory
+    :ivar reloaded_textgroups: The identifiers of the textgroups that changed, were added or were removed by the last
+        reload
+    :ivar texts_parsed: LRU of the parsed TEI texts
+    """
+    SNAPSHOT_FORMAT = 1
+    # Rough ratio between the memory taken by a parsed lxml tree and the size of its XML file
+    TREE_BYTES_PER_FILE_BYTE = 5
+
+    def __init__(self, resource, snapshot_folder=None, fingerprint=None, workers=1, text_cache_items=100,
+                 text_cache_bytes=0, **kwargs):
+        super(FormulaeCTSResolver, self).__init__(resource, **kwargs)
+        self.snapshot_folder = snapshot_folder
+        self.workers = workers
+        self.texts_parsed = BoundedMemoryCache(max_items=text_cache_items, max_size=text_cache_bytes,
+                                               sizeof=lambda entry: entry[1])
+        self.stats = corpus_stats(resource)
+        self.fingerprint = fingerprint if fingerprint is not None else self.load_fingerprint(resource, self.stats)
+        self.corpus_version = corpus_version(self.fingerprint)
+        self.snapshot_time = None
+        self.reloaded_textgroups = []
+        self.__text_versions__ = None
+        if isinstance(self.cache, TwoTierCache):
+            self.cache.namespace = self.corpus_version
+
+    @property
+    def inventory(self):
+        """ The inventory is persisted by its snapshot and is therefore never written to the resolver cache
+
+        :rtype: CtsTextInventoryCollection
+        """
+        if self.__inventory__ is None or len(self.__inventory__.readableDescendants) == 0:
+            self.__inventory__ = self.parse(self.__resources__)
+            set_graph(self.__inventory__.graph)
+        return self.__inventory__
+
+    @inventory.setter
+    def inventory(self, value):
+        self.__inventory__ = value
+        self.__text_versions__ = None
+
+    def text_version(self, objectId):
+        """ The hash of the textgroup folder of a text, which changes whenever one of the files of the textgroup does
+
+        :param objectId: Identifier of the text or of its work or textgroup
+        :type objectId: str
+        :return: The hash or None if objectId is not a text, work or textgroup of the inventory
+        :rtype: str
+        """
+        if self.__text_versions__ is None:
+            versions = {}
+            for text in self.inventory.readableDescendants:
+                version = self.fingerprint.get(os.path.dirname(os.path.dirname(text.path)))
+                versions[text.id] = version
+                versions[str(text.urn.upTo(URN.WORK))] = version
+                versions[str(text.urn.upTo(URN.TEXTGROUP))] = version
+            self.__text_versions__ = versions
+        return self.__text_versions__.get(objectId)
+
+    def read(self, identifier, path):
+        """ Read a text object given an identifier and a path
+
+        Only the metadata is loaded when the corpus is parsed. The TEI file of a text is parsed the first time one of
+        its passages or references is requested and the parsed text is then kept in a LRU bounded by the number of
+        texts and by their estimated memory, so that the memory of a worker does not grow with the corpus.
+
+        :param identifier: Identifier of the text
+        :param path: Path of the text files
+        :return: Text
+        """
+        entry = self.texts_parsed.get(path)
+        if entry is None:
+            with open(path) as f:
+                text = Text(urn=identifier, resource=self.xmlparse(f))
+            entry = (text, os.path.getsize(path) * self.TREE_BYTES_PER_FILE_BYTE)
+            self.texts_parsed.set(path, entry)
+        return entry[0]
+
+    def getMetadata(self, objectId=None, **filters):
+        """ Request metadata about a text or a collection
+
+        The inventory and its top-level collections are returned directly. Only the metadata built for textgroups,
+        works and texts go through the resolver cache, so that its disk tier does not hold copies of the inventory.
+
+        :param objectId: Object Identifier to filter on
+        :type objectId: str
+        :param filters: Kwargs parameters.
+        :type filters: dict
+        :return: Collection
+        """
+        if objectId is None:
+            return self.inventory
+        if objectId in self.inventory.children:
+            return self.inventory[objectId]
+        return self.get_or(
+            _cache_key("Nautilus", self.name, "GetMetadata", objectId, self.text_version(objectId)),
+            super(NautilusCTSResolver, self).getMetadata, objectId
+        )
+
+    def __cache_key_reffs__(self, textId, level, subreference):
+        return _cache_key("Nautilus", self.name, "getReffs", textId, self.text_version(textId), level, subreference)
+
+    def getTextualNode(self, textId, subreference=None, prevnext=False, metadata=False):
+        """ Retrieve a text node from the API
+
+        :param textId: PrototypeText Identifier
+        :type textId: str
+        :param subreference: Passage Reference
+        :type subreference: str
+        :param prevnext: Retrieve graph representing previous and next passage
+        :type prevnext: boolean
+        :param metadata: Retrieve metadata about the passage and the text
+        :type metadata: boolean
+        :return: Passage
+        :rtype: Passage
+        """
+        key = _cache_key("Nautilus", self.name, "Passage", textId, self.text_version(textId), subreference)
+        o = self.cache.get(key)
+        if o is not None:
+            return o
+        text, text_metadata = self.__getText__(textId)
+        if subreference is not None:
+            subreference = Reference(subreference)
+        passage = text.getTextualNode(subreference)
+        passage.set_metadata_from_collection(text_metadata)
+        self.cache.set(key, passage)
+        return passage
+
+    def getReffTree(self, textId, depth=2):
+        """ Retrieve the references of a text down to a citation depth as a tree, in a single traversal of the document
+
+        The nodes of each level are found by the XPath of their citation relative to the node of their parent, instead
+        of querying the whole document once for every parent as getReffs does with a subreference.
+
+        :param textId: PrototypeText Identifier
+        :type textId: str
+        :param depth: The deepest citation level of the tree
+        :type depth: int
+        :return: The top-level references, each with the tree of its children, or the references themselves at depth
+        :rtype: [(str, list)] or [str]
+        """
+        key = _cache_key("Nautilus", self.name, "ReffTree", textId, self.text_version(textId), depth)
+        o = self.cache.get(key)
+        if o is not None:
+            return o
+        text, text_metadata = self.__getText__(textId)
+        citations = list(text.citation)[:depth]
+        tree = reff_tree(text.xml, citations) if citations else []
+        self.cache.set(key, tree)
+        return tree
+
+    def getSiblings(self, textId, subreference):
+        """ Retrieve the siblings of a textual node
+
+        :param textId: PrototypeText Identifier
+        :type textId: str
+        :param subreference: Passage Reference
+        :type subreference: str
+        :return: Tuple of references
+        :rtype: (str, str)
+        """
+        key = _cache_key("Nautilus", self.name, "Siblings", textId, self.text_version(textId), subreference)
+        o = self.cache.get(key)
+        if o is not None:
+            return o
+        siblings = self.getTextualNode(textId, subreference, prevnext=True).siblingsId
+        self.cache.set(key, siblings)
+        return siblings
+
+    @property
+    def fingerprint_path(self):
+        """ The path of the saved fingerprint of the corpus and of the corpus_stats it was computed for
+
+        :rtype: str
+        """
+        if self.snapshot_folder is None:
+            return None
+        return os.path.join(self.snapshot_folder, 'fingerprint.json')
+
+    def load_fingerprint(self, resource, stats):
+        """ Compute the fingerprint of the corpus, taking the hashes of the textgroups whose stats have not changed from
+        the saved fingerprint, and save it if it has changed
+
+        :param resource: The corpus folders
+        :type resource: [str]
+        :param stats: The current corpus_stats of resource
+        :type stats: {str: (int, int, int)}
+        :return: The fingerprint
+        :rtype: {str: str}
+        """
+        path = self.fingerprint_path
+        if path is None:
+            return corpus_fingerprint(resource)
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        fingerprint = {}
+        changed = set(saved) != set(stats)
+        for textgroup, textgroup_stats in stats.items():
+            entry = saved.get(textgroup)
+            if entry is not None and tuple(entry['stats']) == textgroup_stats:
+                fingerprint[textgroup] = entry['digest']
+            else:
+                fingerprint[textgroup] = textgroup_digest(textgroup)
+                changed = True
+        if changed:
+            self.save_fingerprint(fingerprint, stats)
+        return fingerprint
+
+    def save_fingerprint(self, fingerprint, stats):
+        """ Save the fingerprint of the corpus with the corpus_stats it was computed for
+
+        :param fingerprint: The fingerprint
+        :type fingerprint: {str: str}
+        :param stats: The corpus_stats of the textgroups of fingerprint
+        :type stats: {str: (int, int, int)}
+        """
+        path = self.fingerprint_path
+        if path is None:
+            return
+        os.makedirs(self.snapshot_folder, exist_ok=True)
+        saved = {textgroup: {'stats': list(stats[textgroup]), 'digest': digest}
+                 for textgroup, digest in fingerprint.items() if textgroup in stats}
+        with tempfile.NamedTemporaryFile('w', dir=self.snapshot_folder, delete=False) as f:
+            json.dump(saved, f)
+        os.replace(f.name, path)
+
+    @property
+    def snapshot_path(self):
+        """ The path of the snapshot for the current corpus version
+
+        :rtype: str
+        """
+        if self.snapshot_folder is None:
+            return None
+        return os.path.join(self.snapshot_folder, 'inventory-v{}-{}.pickle'.format(self.SNAPSHOT_FORMAT,
+                                                                                  self.corpus_version))
+
+    def parse(self, resource=None, force=False):
+        """ Load the inventory from its snapshot or, if there is none for the current corpus version, parse the corpus
+        folders and save a new snapshot
+
+        :param resource: List of folders
+        :param force: Parse the corpus folders even if a snapshot exists
+        :return: The inventory
+        """
+        if resource is None or resource == self.__resources__:
+            inventory = None if force is True else self.load_snapshot()
+            if inventory is not None:
+                return inventory
+            inventory = self.parse_corpus(self.__resources__)
+            self.snapshot_time = time()
+            if len(inventory.readableDescendants) > 0:
+                self.save_snapshot(inventory)
+            return inventory
+        return self.parse_corpus(resource)
+
+    def parse_corpus(self, resource):
+        """ Parse a list of corpus folders into the dispatcher collection
+
+        The textgroup and work metadata are parsed and dispatched in this process. Reading the TEI files for their
+        citation schemes, which is the expensive part, is spread over self.workers processes. The results are merged
+        in the same order as the serial parsing so that the inventory is the same whatever the number of workers.
+
+        :param resource: List of folders
+        :return: The inventory
+        """
+        texts = []
+        for folder in resource:
+            for __cts__ in glob("{base_folder}/data/*/__cts__.xml".format(base_folder=folder)):
+                texts.extend(self.parse_textgroup(__cts__))
+
+        self.parse_citations(texts)
+        self.remove_empty()
+        self.inventory = self.dispatcher.collection
+        return self.inventory
+
+    def parse_citations(self, texts):
+        """ Read the citation schemes of the TEI files of texts, in self.workers processes, and remove the texts whose
+        citation scheme could not be read from the dispatcher collection
+
+        :param texts: The metadata of the texts
+        :type texts: [XmlCtsTextMetadata]
+        """
+        paths = [text.path for text in texts]
+        if self.workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                citations = list(executor.map(parse_citation, paths,
+                                              chunksize=max(len(paths) // (self.workers * 4), 1)))
+        else:
+            citations = [parse_citation(path) for path in paths]
+
+        removing = []
+        for text, levels in zip(texts, citations):
+            if levels is None:
+                removing.append(text.id)
+                self.logger.error("%s does not accept parsing at some level (most probably citation) ", text.path)
+                continue
+            text.citation = build_citation(levels)
+            self.logger.info("%s has been parsed ", text.path)
+            if text.citation is None or text.citation.isEmpty() is True:
+                removing.append(text.id)
+                self.logger.error("%s has no passages", text.path)
+        for removable in removing:
+            del self.dispatcher.collection[removable]
+
+    def parse_textgroup(self, __cts__):
+        """ Parse and dispatch the metadata of a textgroup and its works
+
+        :param __cts__: The path of the __cts__.xml file of the textgroup
+        :type __cts__: str
+        :return: The metadata of the texts whose TEI file exists
+        :rtype: [XmlCtsTextMetadata]
+        """
+        texts = []
+        removing = []
+        try:
+            with open(__cts__) as __xml__:
+                textgroup = TextGroup.parse(resource=__xml__)
+                tg_urn = str(textgroup.urn)
+            if tg_urn in self.dispatcher.collection:
+                self.dispatcher.collection[tg_urn].update(textgroup)
+            else:
+                self.dispatcher.dispatch(textgroup, path=__cts__)
+
+            for __subcts__ in glob("{parent}/*/__cts__.xml".format(parent=os.path.dirname(__cts__))):
+                with open(__subcts__) as __xml__:
+                    work = Work.parse(resource=__xml__, parent=self.dispatcher.collection[tg_urn])
+                    work_urn = str(work.urn)
+                    if work_urn in self.dispatcher.collection[tg_urn].works:
+                        self.dispatcher.collection[work_urn].update(work)
+
+                for __textkey__ in work.texts:
+                    __text__ = self.dispatcher.collection[__textkey__]
+                    __text__.path = "{directory}/{textgroup}.{work}.{version}.xml".format(
+                        directory=os.path.dirname(__subcts__),
+                        textgroup=__text__.urn.textgroup,
+                        work=__text__.urn.work,
+                        version=__text__.urn.version
+                    )
+                    if os.path.isfile(__text__.path):
+                        texts.append(__text__)
+                    else:
+                        removing.append(__textkey__)
+                        self.logger.error("%s is not present", __text__.path)
+        except MyCapytain.errors.UndispatchedTextError as E:
+            self.logger.error("Error dispatching %s ", __cts__)
+            if self.RAISE_ON_UNDISPATCHED is True:
+                raise UndispatchedTextError(E)
+        except Exception as E:
+            self.logger.error("Error parsing %s ", __cts__)
+
+        for removable in removing:
+            del self.dispatcher.collection[removable]
+        return texts
+
+    def remove_empty(self):
+        """ Remove the collections without readable descendants from the dispatcher collection"""
+        if self.REMOVE_EMPTY is not True:
+            return
+        removing = [item.id for item in self.dispatcher.collection.descendants
+                    if item.readable != True and len(item.readableDescendants) == 0]
+        # Remove them only if they have not been removed before
+        for removable in removing:
+            if removable in self.dispatcher.collection:
+                del self.dispatcher.collection[removable]
+
+    def reload(self):
+        """ Re-parse the textgroups whose files have changed since the inventory was parsed or loaded
+
+        The textgroups are re-parsed into a copy of the inventory, which then replaces the current one, so that requests
+        served during the reload still see a complete inventory. Only the cache entries and parsed texts of the
+        changed textgroups are invalidated.
+
+        :return: The textgroup folders that have changed, were added or were removed
+        :rtype: [str]
+        """
+        stats = corpus_stats(self.__resources__)
+        candidates = [textgroup for textgroup in sorted(set(stats) | set(self.stats))
+                      if stats.get(textgroup) != self.stats.get(textgroup)]
+        fingerprint = dict(self.fingerprint)
+        changed = []
+        for textgroup in candidates:
+            digest = textgroup_digest(textgroup) if textgroup in stats else None
+            if digest != fingerprint.get(textgroup):
+                changed.append(textgroup)
+                if digest is None:
+                    fingerprint.pop(textgroup, None)
+                else:
+                    fingerprint[textgroup] = digest
+        self.stats = stats
+        if candidates:
+            self.save_fingerprint(fingerprint, stats)
+        if not changed:
+            return changed
+
+        old_texts = [text for text in self.inventory.readableDescendants
+                     if os.path.dirname(os.path.dirname(text.path)) in changed]
+        inventory = pickle.loads(pickle.dumps(self.inventory, protocol=pickle.HIGHEST_PROTOCOL))
+        set_graph(inventory.graph)
+        self.dispatcher.collection = inventory
+        for textgroup in {str(text.urn.upTo(URN.TEXTGROUP)) for text in old_texts}:
+            self.remove_textgroup(textgroup)
+        texts = []
+        for textgroup in changed:
+            __cts__ = os.path.join(textgroup, '__cts__.xml')
+            if os.path.isfile(__cts__):
+                texts.extend(self.parse_textgroup(__cts__))
+        self.parse_citations(texts)
+        self.remove_empty()
+        self.reloaded_textgroups = sorted({str(text.urn.upTo(URN.TEXTGROUP)) for text in old_texts + texts})
+
+        self.fingerprint = fingerprint
+        self.corpus_version = corpus_version(fingerprint)
+        self.snapshot_time = time()
+        self.inventory = inventory
+        for text in old_texts:
+            self.texts_parsed.delete(text.path)
+        # Every worker reloads the same changes, only the first one needs to save the snapshot
+        path = self.snapshot_path
+        if path is not None and not os.path.isfile(path) and len(inventory.readableDescendants) > 0:
+            self.save_snapshot(inventory)
+        self.logger.info("Reloaded %s", ', '.join(changed))
+        return changed
+
+    def remove_textgroup(self, objectId):
+        """ Remove a textgroup and all its descendants, including their metadata, from the dispatcher collection
+
+        :param objectId: The identifier of the textgroup
+        :type objectId: str
+        """
+        if objectId not in self.dispatcher.collection:
+            return
+        textgroup = self.dispatcher.collection[objectId]
+        for item in textgroup.descendants[::-1] + [textgroup]:
+            del self.dispatcher.collection[item.id]
+
+    @property
+    def reload_trigger(self):
+        """ The file whose modification tells the application workers to reload the corpus
+
+        :return: The path or None if the resolver does not save snapshots
+        :rtype: str
+        """
+        if self.snapshot_folder is None:
+            return None
+        return os.path.join(self.snapshot_folder, 'reload')
+
+    def load_snapshot(self):
+        """ Load the inventory snapshot for the current corpus version and set it as the dispatcher collection
+
+        :return: The inventory or None if there is no valid snapshot
+        """
+        path = self.snapshot_path
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception as E:
+            self.logger.warning("Snapshot %s could not be loaded: %s", path, E)
+            return None
+        if snapshot.get('format') != self.SNAPSHOT_FORMAT or snapshot.get('corpus_version') != self.corpus_version:
+            return None
+        self.dispatcher.collection = snapshot['inventory']
+        self.inventory = snapshot['inventory']
+        self.snapshot_time = snapshot['time']
+        self.logger.info("Inventory loaded from snapshot %s", path)
+        return snapshot['inventory']
+
+    def save_snapshot(self, inventory):
+        """ Save the inventory as the snapshot of the current corpus version and remove older snapshots
+
+        :param inventory: The parsed inventory
+        """
+        path = self.snapshot_path
+        if path is None:
+            return
+        os.makedirs(self.snapshot_folder, exist_ok=True)
+        snapshot = {'format': self.SNAPSHOT_FORMAT, 'corpus_version': self.corpus_version,
+                    'time': self.snapshot_time, 'inventory': inventory}
+        with tempfile.NamedTemporaryFile(dir=self.snapshot_folder, delete=False) as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # os.replace is atomic so that workers starting at the same time never read a half-written snapshot
+        os.replace(f.name, path)
+        for old in glob(os.path.join(self.snapshot_folder, 'inventory-*.pickle')):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        self.logger.info("Inventory snapshot saved to %s", path)
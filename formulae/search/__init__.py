@@ -1,5 +1,17 @@
 from flask import Blueprint
+from formulae.cache import CachePolicy
 
 bp = Blueprint('search', __name__)
+# How the responses of the routes may be cached (see NemoFormulae.after_request). The documentation is shared like the
+# corpus pages. The results and suggestions follow the search index, which is not purged from the shared cache, and so
+# are only kept by the browser. The search forms redirect or flash their validation errors and are not kept.
+bp.cache_policies = {
+    "r_search_docs": CachePolicy(max_age='CACHE_BROWSER_MAX_AGE', s_maxage='CACHE_MAX_AGE',
+                                 vary=('Cookie', 'Accept-Language')),
+    "r_results": CachePolicy(max_age='CACHE_BROWSER_MAX_AGE', vary=('Cookie', 'Accept-Language')),
+    "word_search_suggester": CachePolicy(max_age='CACHE_BROWSER_MAX_AGE'),
+    "r_simple_search": CachePolicy(),
+    "r_advanced_search": CachePolicy()
+}
 
 from formulae.search import routes
@@ -88,8 +88,7 @@ def r_results():
 def r_advanced_search():
     from formulae.app import nemo
     form = AdvancedSearchForm()
-    colls = nemo.sub_colls
-    form.corpus.choices = form.corpus.choices + [(x['id'].split(':')[-1], x['short_title'].strip()) for y in colls.values() for x in y if 'commentary' not in x['id']]
+    form.corpus.choices = form.corpus.choices + list(nemo.corpus_choices)
     ignored_fields = ('exclusive_date_range', 'fuzziness', 'lemma_search', 'slop', 'in_order')
     data_present = [x for x in form.data if form.data[x] and form.data[x] != 'none' and x not in ignored_fields]
     if form.validate() and data_present:
@@ -0,0 +1,159 @@
+from contextlib import contextmanager
+from time import perf_counter
+import gc
+import json
+import os
+import resource
+
+
+def max_rss():
+    """ The peak resident memory of the current process
+
+    :return: The peak resident memory in kilobytes
+    :rtype: int
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def memory_usage(pid):
+    """ The resident, proportional and unique memory of a process as reported by /proc (Linux only)
+
+    The unique set size (USS) is the memory that would be freed if the process ended, i.e. the pages that it does not
+    share, e.g. copy-on-write, with the gunicorn master or the other workers.
+
+    :param pid: The process id
+    :type pid: int
+    :return: The RSS, PSS and USS of the process in kilobytes
+    :rtype: {str: int}
+    """
+    usage = {'rss': 0, 'pss': 0, 'uss': 0}
+    path = '/proc/{}/smaps_rollup'.format(pid)
+    if not os.path.exists(path):
+        path = '/proc/{}/smaps'.format(pid)
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 2 or not parts[0].endswith(':'):
+                continue
+            field = parts[0][:-1]
+            if field == 'Rss':
+                usage['rss'] += int(parts[1])
+            elif field == 'Pss':
+                usage['pss'] += int(parts[1])
+            elif field in ('Private_Clean', 'Private_Dirty'):
+                usage['uss'] += int(parts[1])
+    return usage
+
+
+def child_processes(pid):
+    """ The ids of the child processes of a process, e.g. the workers of the gunicorn master (Linux only)
+
+    :param pid: The process id
+    :type pid: int
+    :rtype: [int]
+    """
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                # The command name, in parentheses, may contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def freeze_shared_memory(logger=None):
+    """ Move all objects allocated so far out of the reach of the garbage collector
+
+    This is called in the gunicorn master after the application has been loaded. Otherwise the collections in the
+    forked workers would write to the headers of the shared objects and so copy the pages that hold them.
+    This requires Python 3.7 or later (gc.freeze). Older versions only collect and log a warning.
+
+    :param logger: The log for the warning, e.g., app.logger
+    :type logger: logging.Logger
+    :return: Whether the objects were frozen
+    :rtype: bool
+    """
+    gc.collect()
+    if not hasattr(gc, 'freeze'):
+        if logger is not None:
+            logger.warning('gc.freeze requires Python 3.7 or later: the workers will copy the shared objects that '
+                           'their garbage collections touch.')
+        return False
+    gc.freeze()
+    return True
+
+
+class StartupReport(object):
+    """ Records the wall time and the peak memory of the phases of the start of a worker
+
+    Phases can be nested. They are reported in the order in which they started.
+
+    :ivar phases: For every phase, its name, depth, wall time in seconds, the peak resident memory of the process in
+        kilobytes when it ended and by how much it raised that peak
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.depth = 0
+
+    @contextmanager
+    def phase(self, name):
+        """ Record the phase run in the body of the with statement
+
+        :param name: The name of the phase
+        :type name: str
+        """
+        entry = {'phase': name, 'depth': self.depth}
+        self.phases.append(entry)
+        self.depth += 1
+        start_rss = max_rss()
+        start = perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = round(perf_counter() - start, 4)
+            entry['max_rss_kb'] = max_rss()
+            entry['max_rss_growth_kb'] = entry['max_rss_kb'] - start_rss
+            self.depth -= 1
+
+    @property
+    def total_seconds(self):
+        """ The wall time of the top-level phases
+
+        :rtype: float
+        """
+        return round(sum(p.get('seconds', 0) for p in self.phases if p['depth'] == 0), 4)
+
+    def as_dict(self):
+        """ The report as a JSON serializable dictionary
+
+        :rtype: dict
+        """
+        return {'total_seconds': self.total_seconds, 'max_rss_kb': max_rss(), 'phases': self.phases}
+
+    def log(self, logger):
+        """ Write the report to a log as a single JSON line
+
+        :param logger: The log, e.g., app.logger
+        :type logger: logging.Logger
+        """
+        logger.info('Startup report: %s', json.dumps(self.as_dict()))
+
+    def format(self):
+        """ The report as a human readable table
+
+        :rtype: str
+        """
+        lines = ['{:<40} {:>10} {:>14} {:>14}'.format('Phase', 'Seconds', 'Peak RSS (kB)', 'Growth (kB)')]
+        for p in self.phases:
+            lines.append('{:<40} {:>10.4f} {:>14} {:>14}'.format('  ' * p['depth'] + p['phase'], p.get('seconds', 0),
+                                                                 p.get('max_rss_kb', ''),
+                                                                 p.get('max_rss_growth_kb', '')))
+        lines.append('{:<40} {:>10.4f} {:>14}'.format('Total', self.total_seconds, max_rss()))
+        return '\n'.join(lines)
@@ -0,0 +1,55 @@
+from lxml import etree
+from threading import local
+from time import time
+import os
+
+
+class XSLTRegistry(object):
+    """ Compiled XSL stylesheets, by path
+
+    A stylesheet is compiled the first time it is requested by a thread and is then kept for that thread. Sharing one
+    XSLT object would not spare these compilations: its document is bound to the dictionary of the thread that parsed
+    it, so lxml copies and compiles the stylesheet again whenever it is applied in another thread.
+    The stylesheet is compiled again when its file has changed, which is checked at most every check_interval seconds.
+
+    :param check_interval: The seconds between two checks of the modification time of a file. 0 means every request.
+    :type check_interval: int
+    """
+
+    def __init__(self, check_interval=0):
+        self.check_interval = check_interval
+        self._local = local()
+
+    @property
+    def stylesheets(self):
+        """ The stylesheets compiled by the current thread
+
+        :return: dictionary with the paths as keys and (modification time, time of the last check, XSLT) as values
+        :rtype: {str: (int, float, etree.XSLT)}
+        """
+        try:
+            return self._local.stylesheets
+        except AttributeError:
+            self._local.stylesheets = {}
+            return self._local.stylesheets
+
+    def get(self, path):
+        """ Retrieve the compiled stylesheet of a file
+
+        :param path: The path of the XSL file
+        :type path: str
+        :return: The compiled stylesheet
+        :rtype: etree.XSLT
+        """
+        now = time()
+        entry = self.stylesheets.get(path)
+        if entry is not None and now - entry[1] < self.check_interval:
+            return entry[2]
+        mtime = os.stat(path).st_mtime_ns
+        if entry is None or entry[0] != mtime:
+            with open(path) as f:
+                entry = (mtime, now, etree.XSLT(etree.parse(f)))
+        else:
+            entry = (mtime, now, entry[2])
+        self.stylesheets[path] = entry
+        return entry[2]
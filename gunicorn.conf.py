@@ -0,0 +1,31 @@
+""" Gunicorn settings, used with ``gunicorn -c gunicorn.conf.py app:flask_app``
+
+With preload_app, the application, i.e. the resolver with its inventory, the sub-collection catalogue and the compiled
+templates, is built once in the master and shared copy-on-write with the forked workers instead of being built in every
+worker. Set GUNICORN_PRELOAD=0 to load the application in each worker instead.
+The loaded objects are only kept out of the garbage collections of the workers, which would otherwise copy them, with
+Python 3.7 or later (see formulae.startup.freeze_shared_memory).
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    """ Finish loading the application in the master before the workers are forked"""
+    if server.cfg.preload_app:
+        from formulae.app import nemo
+        from formulae.startup import freeze_shared_memory
+        nemo.preload()
+        nemo.startup_report.log(nemo.app.logger)
+        freeze_shared_memory(nemo.app.logger)
+
+
+def post_fork(server, worker):
+    """ Database connections must not be shared between processes, so each worker opens its own"""
+    if server.cfg.preload_app:
+        from formulae.app import flask_app
+        from formulae import db
+        with flask_app.app_context():
+            for bind in [None] + list(flask_app.config.get('SQLALCHEMY_BINDS') or {}):
+                db.get_engine(flask_app, bind=bind).dispose()
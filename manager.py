@@ -1,7 +1,117 @@
-from formulae.app import resolver, nautilus_api
-from capitains_nautilus.manager import FlaskNautilusManager
+from formulae.app import flask_app, resolver, nemo, startup_report
+from formulae.prerender import prerender as prerender_texts
+from formulae.startup import memory_usage, child_processes
+from formulae.models import CitationReff
+from formulae.cache import TwoTierCache
+from formulae import db
+import click
+import json
+import os
+
+
+@click.group()
+def manager():
+    """ CLI for the maintenance of the Formulae - Litterae - Chartae application """
+
+
+@manager.command()
+def parse():
+    """ Parse the corpus and save a new snapshot of its inventory """
+    ret = resolver.parse(force=True)
+    click.echo("Preprocessed %s texts" % len(ret.readableDescendants))
+
+
+@manager.command()
+def reload():
+    """ Save the inventory snapshot of the current corpus and tell the running workers to reload the textgroups that
+    have changed """
+    texts = resolver.getMetadata().readableDescendants
+    if resolver.reload_trigger is None:
+        raise click.ClickException("There is no snapshot folder in which to write the reload trigger")
+    os.makedirs(os.path.dirname(resolver.reload_trigger), exist_ok=True)
+    with open(resolver.reload_trigger, 'a'):
+        os.utime(resolver.reload_trigger)
+    click.echo("Preprocessed %s texts. The workers will reload on their next request." % len(texts))
+
+
+@manager.command()
+@click.argument('urns', nargs=-1)
+def build_reff_index(urns):
+    """ Extract the reference tree of every text (or only of URNS) into the application database """
+    with flask_app.app_context():
+        if not db.engine.has_table(CitationReff.__tablename__):
+            raise click.ClickException("The citation_reff table does not exist. Run 'flask db upgrade' first.")
+        count = CitationReff.rebuild(resolver, objectIds=list(urns) or None)
+    click.echo("Indexed %s references" % count)
+
+
+@manager.command()
+@click.argument('urns', nargs=-1)
+@click.option('--workers', type=int, default=os.cpu_count(), help="Number of rendering processes")
+@click.option('--prune', is_flag=True, help="Remove the fragments of older versions of the texts")
+def prerender(urns, workers, prune):
+    """ Render the passages of every text (or only of URNS) to the fragment folder, from which they are then served """
+    if prune and urns:
+        raise click.ClickException("Fragments can only be pruned when the whole corpus is rendered")
+    objectIds = list(urns) or [text.id for text in resolver.getMetadata().readableDescendants]
+    paths = prerender_texts(nemo, objectIds, workers=workers)
+    click.echo("%s passages of %s texts are rendered" % (len(paths), len(objectIds)))
+    if prune:
+        click.echo("Removed %s old fragments" % nemo.fragments.prune(set(paths)))
+
+
+@manager.command('prune-cache')
+@click.option('--max-age', type=int, default=86400,
+              help="Only remove the folders that have not been used for this many seconds")
+def prune_cache(max_age):
+    """ Remove the resolver and passage cache folders of older corpus versions, which the workers that still serve
+    these versions, e.g. during a rolling restart, keep using until they are restarted """
+    for cache in (resolver.cache, nemo.passage_cache):
+        if isinstance(cache, TwoTierCache):
+            for folder in cache.prune(max_age=max_age):
+                click.echo("Removed %s" % os.path.join(cache.cache_dir, folder))
+
+
+@manager.command()
+def precompile():
+    """ Compile all the templates into the template cache folder, from which the workers then load them, and fail if any
+    of them cannot be compiled """
+    compiled, errors = nemo.compile_templates()
+    for template, error in errors.items():
+        click.echo("%s: %s" % (template, error), err=True)
+    if errors:
+        raise click.ClickException("%s templates could not be compiled" % len(errors))
+    click.echo("Compiled %s templates into %s" % (len(compiled), flask_app.config['TEMPLATE_CACHE_DIRECTORY']))
+
+
+@manager.command('startup-report')
+@click.option('--as-json', is_flag=True, help="Print the report as JSON")
+@click.option('--max-seconds', type=float, default=None, help="Fail if the start took longer than this")
+def report_startup(as_json, max_seconds):
+    """ Report the wall time and peak memory of the phases of the start of the application """
+    if as_json:
+        click.echo(json.dumps(startup_report.as_dict(), indent=2))
+    else:
+        click.echo(startup_report.format())
+    if max_seconds is not None and startup_report.total_seconds > max_seconds:
+        raise click.ClickException("The start took {}s, more than the maximum of {}s".format(
+            startup_report.total_seconds, max_seconds))
+
+
+@manager.command('worker-memory')
+@click.argument('master_pid', type=int)
+def worker_memory(master_pid):
+    """ Report the resident (RSS), proportional (PSS) and unique (USS) memory in kB of the workers of the gunicorn
+    master MASTER_PID """
+    click.echo('{:>8} {:>10} {:>10} {:>10}'.format('PID', 'RSS', 'PSS', 'USS'))
+    totals = {'rss': 0, 'pss': 0, 'uss': 0}
+    for pid in [master_pid] + child_processes(master_pid):
+        usage = memory_usage(pid)
+        click.echo('{:>8} {rss:>10} {pss:>10} {uss:>10}'.format(pid, **usage))
+        for key in totals:
+            totals[key] += usage[key]
+    click.echo('{:>8} {rss:>10} {pss:>10} {uss:>10}'.format('Total', **totals))
 
-manager = FlaskNautilusManager(resolver, nautilus_api)
 
 if __name__ == "__main__":
     manager()
@@ -1,25 +1,43 @@
 from config import Config
 from capitains_nautilus.cts.resolver import NautilusCTSResolver
-from formulae import create_app, db, mail
+from formulae import create_app, db, login, mail
+from formulae.resolver import FormulaeCTSResolver, corpus_fingerprint, corpus_version, textgroup_digest
+from formulae.cache import BoundedMemoryCache, TwoTierCache
+from formulae.startup import StartupReport, freeze_shared_memory, memory_usage
+from formulae.prerender import FragmentStore, prerender
+from formulae.highlight import SentenceMatcher
+from formulae.jinjaext import FragmentCache
+from formulae.relations import CommentaryIndex
 from formulae.nemo import NemoFormulae
-from formulae.models import User
+from formulae.models import User, CitationReff, NtComRels
 from formulae.search.Search import advanced_query_index, query_index, build_sort_list, suggest_word_search
-from formulae.dispatcher_builder import organizer
+from formulae.dispatcher_builder import organizer, build_organizer
 import flask_testing
+from jinja2 import FileSystemBytecodeCache, TemplateNotFound
+from flask_nemo import Nemo
 from formulae.search.forms import AdvancedSearchForm, SearchForm
 from formulae.auth.forms import LoginForm, PasswordChangeForm, LanguageChangeForm, ResetPasswordForm, \
     ResetPasswordRequestForm, RegistrationForm, ValidationError
 from flask_login import current_user
 from flask_babel import _
 from elasticsearch import Elasticsearch
-from unittest.mock import patch
+from unittest import TestCase
+from unittest.mock import patch, call, Mock
 from .fake_es import FakeElasticsearch
 from collections import OrderedDict
 import os
+import pickle
+import shutil
+import tempfile
+import threading
 from MyCapytain.common.constants import Mimetypes
-from flask import Markup, url_for, abort
+from flask import Markup, url_for, abort, session
 import re
 from math import ceil
+from time import time
+from threading import Thread
+from lxml import etree
+from rdflib.namespace import RDFS
 
 
 class TestConfig(Config):
@@ -36,7 +54,7 @@ class Formulae_Testing(flask_testing.TestCase):
     def create_app(self):
 
         app = create_app(TestConfig)
-        self.nemo = NemoFormulae(name="InstanceNemo", resolver=NautilusCTSResolver(app.config['CORPUS_FOLDERS'],
+        self.nemo = NemoFormulae(name="InstanceNemo", resolver=FormulaeCTSResolver(app.config['CORPUS_FOLDERS'],
                                                                                    dispatcher=organizer),
                                  app=app, base_url="", transform={"default": "components/epidoc.xsl",
                                                                   "notes": "components/extract_notes.xsl"},
@@ -74,6 +92,483 @@ class TestFunctions(Formulae_Testing):
         first = self.nemo.get_first_passage('urn:cts:cjhnt:nt.86-Jud.grc001')
         self.assertEqual(first, '1.1-1.20')
 
+    def test_citation_index(self):
+        """ Make sure that references are answered from the citation index as they would be by the resolver"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        comm = 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1'
+        with self.client:
+            self.client.get('/')
+            expected_work = self.nemo.r_work(nt)['collections']['readable']
+            expected_siblings = self.nemo.get_siblings(comm, '21-40', None)
+            expected_sub = self.nemo.resolver.getReffs(comm, subreference='2')
+            appmeta_version = self.nemo.commentary_index_version()
+            self.assertGreater(CitationReff.rebuild(self.nemo.resolver), 0)
+            self.assertEqual(self.nemo.commentary_index_version(), appmeta_version,
+                             'Building the index should not reload the NT-commentary relations.')
+            with patch.object(self.nemo.resolver, 'getReffs') as mock_reffs:
+                self.assertEqual(self.nemo.r_work(nt)['collections']['readable'], expected_work)
+                self.assertEqual(self.nemo.get_first_passage(nt), '1.1-1.20')
+                self.assertEqual(self.nemo.get_siblings(comm, '21-40', None), expected_siblings)
+                self.assertEqual(self.nemo.get_indexed_reffs(comm, subreference='2'), expected_sub)
+                mock_reffs.assert_not_called()
+            self.nemo.resolver.text_version = lambda objectId: 'outdated'
+            self.assertEqual(self.nemo.get_indexed_reff_tree(nt), None,
+                             'An outdated index should not be used.')
+            self.nemo.citation_index_exists = None
+            with patch.object(db.get_engine(self.app), 'has_table', return_value=False) as mock_table, \
+                    patch.object(CitationReff, 'query') as mock_query:
+                self.nemo.get_indexed_reffs(nt)
+                self.assertIsNone(self.nemo.get_indexed_reff_tree(nt))
+                mock_table.assert_called_once_with('citation_reff')
+                mock_query.filter_by.assert_not_called()
+                mock_query.filter.assert_not_called()
+
+    def test_catalogue(self):
+        """ Make sure that the sub-collection catalogue is saved once per corpus version and then loaded"""
+        live = self.nemo.make_members(self.nemo.resolver.getMetadata('urn:cts:cjhnt:nt'), lang='ger')
+        self.assertEqual([dict(m, short_title=None, parent=None)
+                          for m in self.nemo.get_catalogue_members('urn:cts:cjhnt:nt', 'ger')],
+                         [dict(m, short_title=None, parent=None) for m in live])
+        self.assertIn('short_title', self.nemo.sub_colls['new_testament'][0])
+        with self.assertRaises(TypeError):
+            self.nemo.sub_colls['new_testament'][0]['label'] = 'changed'
+        record = self.nemo.sub_colls['new_testament'][0]
+        with self.assertRaises(AttributeError):
+            record.label = 'changed'
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        self.assertEqual(len(record), len(dict(record)))
+        with self.client as c:
+            for url in ['/collections', '/collections/urn:cts:cjhnt:nt', '/collections/urn:cts:cjhnt:nt.86-Jud']:
+                self.assertEqual(c.get(url).status_code, 200, url + ' should be rendered from the member records.')
+            self.client.get('/')
+            collection = self.nemo.resolver.getMetadata('urn:cts:cjhnt:nt')
+            data = self.nemo.r_collection('urn:cts:cjhnt:nt', lang='eng')
+            self.assertEqual([dict(p, semantic=None, short_title=None, parent=None) for p in data['collections']['parents']],
+                             [dict(p, semantic=None, short_title=None, parent=None)
+                              for p in self.nemo.make_parents(collection, lang='eng')])
+            self.assertEqual(data['collections']['current']['label'], str(collection.get_label('eng')))
+        with tempfile.TemporaryDirectory() as snapshot_folder:
+            self.nemo.resolver.snapshot_folder = snapshot_folder
+            expected = self.nemo.load_catalogue()
+            self.assertTrue(os.path.isfile(self.nemo.catalogue_path), 'The catalogue should have been saved.')
+            with patch.object(self.nemo, 'build_catalogue') as mock_build:
+                self.assertEqual({lang: dict(c.members) for lang, c in self.nemo.load_catalogue().items()},
+                                 {lang: dict(c.members) for lang, c in expected.items()})
+                mock_build.assert_not_called()
+
+    def test_startup_report(self):
+        """ Make sure that the startup phases are timed in the order in which they started"""
+        self.assertEqual([p['phase'] for p in self.nemo.startup_report.phases], ['nemo', 'catalogue', 'commentary_index'])
+        report = StartupReport()
+        with report.phase('outer'):
+            with report.phase('inner'):
+                pass
+        self.assertEqual([(p['phase'], p['depth']) for p in report.phases], [('outer', 0), ('inner', 1)])
+        self.assertEqual(report.total_seconds, report.phases[0]['seconds'])
+        self.assertGreater(report.phases[0]['max_rss_kb'], 0)
+        self.assertIn('  inner', report.format())
+
+    def test_freeze_shared_memory(self):
+        """ Make sure that a warning is logged where gc.freeze does not exist, i.e. before Python 3.7"""
+        logger = Mock()
+        with patch('formulae.startup.gc', Mock(spec=['collect'])) as mock_gc:
+            self.assertFalse(freeze_shared_memory(logger))
+            mock_gc.collect.assert_called_once_with()
+            logger.warning.assert_called_once()
+        with patch('formulae.startup.gc', Mock(spec=['collect', 'freeze'])) as mock_gc:
+            self.assertTrue(freeze_shared_memory(logger))
+            mock_gc.freeze.assert_called_once_with()
+
+    def test_preload(self):
+        """ Make sure that preloading builds the text versions and the templates before the first request"""
+        with patch.object(self.app.jinja_env, 'get_template', wraps=self.app.jinja_env.get_template) as mock_get, \
+                patch.object(self.nemo.resolver, 'getReffs', wraps=self.nemo.resolver.getReffs) as mock_reffs:
+            self.nemo.preload()
+            self.assertIn(call('main::collection.html'), mock_get.call_args_list)
+            mock_reffs.assert_not_called()
+        self.assertEqual(len(self.nemo.sibling_tables), 0, 'Texts that are not indexed should not be parsed at boot.')
+        with self.app.app_context():
+            CitationReff.rebuild(self.nemo.resolver, ['urn:cts:cjhnt:nt.86-Jud.grc001'])
+            self.assertEqual(self.nemo.get_indexed_texts(), {'urn:cts:cjhnt:nt.86-Jud.grc001'})
+        with patch.object(self.nemo.resolver, 'getReffs') as mock_reffs:
+            self.nemo.preload()
+            mock_reffs.assert_not_called()
+        self.assertEqual(len(self.nemo.sibling_tables), 1)
+        self.assertTrue(self.nemo.sibling_tables.has('urn:cts:cjhnt:nt.86-Jud.grc001'))
+        self.assertIsNotNone(self.nemo.resolver.text_version('urn:cts:cjhnt:nt.86-Jud.grc001'))
+        self.assertEqual(self.nemo.startup_report.phases[-1]['phase'], 'preload')
+        usage = memory_usage(os.getpid())
+        self.assertGreater(usage['rss'], 0)
+        self.assertLessEqual(usage['uss'], usage['rss'])
+
+    def test_compile_templates(self):
+        """ Make sure that all the templates are compiled into the bytecode cache and that errors are reported"""
+        env = self.app.jinja_env
+        with tempfile.TemporaryDirectory() as folder:
+            env.bytecode_cache = FileSystemBytecodeCache(folder)
+            env.cache.clear()
+            compiled, errors = self.nemo.compile_templates()
+            self.assertIn('main::multipassage.html', compiled)
+            self.assertIn('search::search.html', compiled)
+            self.assertEqual(errors, {})
+            self.assertEqual(len(os.listdir(folder)), len(compiled))
+            env.cache.clear()
+            with patch.object(env, 'compile', wraps=env.compile) as mock_compile:
+                env.get_template('main::container.html')
+                mock_compile.assert_not_called()
+            env.bytecode_cache = None
+        with patch.object(env, 'list_templates', return_value=['main::container.html', 'main::broken.html']):
+            compiled, errors = self.nemo.compile_templates()
+        self.assertEqual(compiled, ['main::container.html'])
+        self.assertIsInstance(errors['main::broken.html'], TemplateNotFound)
+
+    def test_xslt_registry(self):
+        """ Make sure that XSL stylesheets are compiled once per thread and again when their file changes"""
+        with tempfile.TemporaryDirectory() as folder:
+            xsl = os.path.join(folder, 'notes.xsl')
+            shutil.copy(self.nemo._transform['notes'], xsl)
+            self.nemo._transform['notes'] = xsl
+            with patch('formulae.xslt.etree.XSLT', wraps=etree.XSLT) as mock_xslt:
+                notes = self.nemo.extract_notes('<div><p>Text</p></div>')
+                self.assertEqual(self.nemo.extract_notes('<div><p>Text</p></div>'), notes)
+                self.assertEqual(mock_xslt.call_count, 1)
+                other_thread = Thread(target=self.nemo.xslt.get, args=(xsl,))
+                other_thread.start()
+                other_thread.join()
+                self.assertEqual(mock_xslt.call_count, 2, 'Each thread should compile its own stylesheet.')
+                os.utime(xsl, (time() + 10, time() + 10))
+                self.nemo.extract_notes('<div><p>Text</p></div>')
+                self.assertEqual(mock_xslt.call_count, 3, 'A changed stylesheet should be compiled again.')
+                self.nemo.xslt.check_interval = 60
+                with patch('formulae.xslt.os.stat', wraps=os.stat) as mock_stat:
+                    os.utime(xsl, (time() + 20, time() + 20))
+                    self.nemo.extract_notes('<div><p>Text</p></div>')
+                    mock_stat.assert_not_called()
+                    self.assertEqual(mock_xslt.call_count, 3, 'The file should not be checked within the interval.')
+                    with patch('formulae.xslt.time', return_value=time() + 60):
+                        self.nemo.extract_notes('<div><p>Text</p></div>')
+                    self.assertEqual(mock_xslt.call_count, 4)
+
+    def test_passage_cache(self):
+        """ Make sure that rendered passages are cached by text, reference, transform, locale and text version"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        with self.client:
+            self.client.get('/')
+            expected = self.nemo.r_passage(nt, '1.1')
+            with patch.object(self.nemo, 'transform_tree') as mock_transform:
+                data = self.nemo.r_passage(nt, '1.1')
+                mock_transform.assert_not_called()
+            self.assertEqual(data['text_passage'], expected['text_passage'])
+            self.assertEqual(data['notes'], expected['notes'])
+            self.assertEqual((self.nemo.passage_cache.hits, self.nemo.passage_cache.misses), (1, 1))
+            key = self.nemo.passage_cache_key(nt, '1.1')
+            self.nemo.resolver.text_version = lambda objectId: 'changed'
+            self.assertNotEqual(self.nemo.passage_cache_key(nt, '1.1'), key)
+        with tempfile.TemporaryDirectory() as cache_folder:
+            resolver_cache = TwoTierCache(cache_folder, namespace='version')
+            passage_cache = TwoTierCache(cache_folder, namespace='version', prefix='passages-')
+            passage_cache.set('key', ('passage', 'notes'))
+            resolver_cache.namespace = 'new_version'
+            self.assertEqual(resolver_cache.prune(), ['resolver-version'])
+            self.assertEqual(TwoTierCache(cache_folder, namespace='version', prefix='passages-').get('key'),
+                             ('passage', 'notes'), 'Caches with other prefixes should not be removed.')
+            self.assertEqual((passage_cache.hits, passage_cache.misses), (0, 0))
+
+    def test_render_passage_single_pass(self):
+        """ Make sure that notes and highlighting are taken from the transformed tree without parsing the html again"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        with self.client:
+            self.client.get('/')
+            text = self.nemo.get_passage(objectId=nt, subreference='1.1')
+            expected = self.nemo.transform(text, text.export(Mimetypes.PYTHON.ETREE), nt)
+            words = [span.text for span in etree.fromstring(expected).xpath('//span[@class="w"]')][1:4]
+            highlighted = self.nemo.highlight_found_sents(expected, [' '.join(words)])
+            self.assertIn('<span class="searched">', highlighted)
+            with patch.object(etree, 'fromstring', side_effect=etree.fromstring) as mock_fromstring:
+                passage, notes = self.nemo.render_passage(text, nt, '1.1', sents=[' '.join(words)])
+                mock_fromstring.assert_not_called()
+            # The result tree of the XSLT escapes non-ASCII characters when it is serialized, a parsed one does not
+            self.assertEqual(etree.tostring(etree.fromstring(passage), encoding=str, method='html'), highlighted)
+            self.assertEqual(notes, self.nemo.extract_notes(expected))
+            self.assertEqual(len(self.nemo.passage_cache), 0, 'Highlighted passages should not be cached.')
+            self.assertEqual(self.nemo.render_passage(text, nt, '1.1'), (expected, notes))
+            self.assertEqual(self.nemo.render_passage(text, nt, '1.1', sents=[' '.join(words)]), (highlighted, notes))
+
+    def test_prerender(self):
+        """ Make sure that prerendered passages are served from the fragment store and rendered live otherwise"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        with tempfile.TemporaryDirectory() as fragment_folder, self.client:
+            self.client.get('/')
+            expected = self.nemo.r_passage(nt, '1.1')
+            self.nemo.passage_cache.clear()
+            misses = self.nemo.passage_cache.misses
+            self.nemo.fragments = FragmentStore(fragment_folder)
+            try:
+                paths = prerender(self.nemo, [nt])
+                self.assertIn(self.nemo.fragments.path(self.nemo.fragment_key(nt, '1.1')), paths)
+                self.assertIn(self.nemo.fragments.path(self.nemo.fragment_key(nt, '1.1-1.20')), paths)
+                self.assertTrue(all(os.path.isfile(path) for path in paths))
+                with patch.object(self.nemo, 'transform_tree') as mock_transform:
+                    data = self.nemo.r_passage(nt, '1.1')
+                    mock_transform.assert_not_called()
+                self.assertEqual(data['text_passage'], expected['text_passage'])
+                self.assertEqual(data['notes'], expected['notes'])
+                self.assertEqual(self.nemo.passage_cache.misses, misses)
+                os.remove(self.nemo.fragments.path(self.nemo.fragment_key(nt, '1.1')))
+                self.assertEqual(self.nemo.r_passage(nt, '1.1')['text_passage'], expected['text_passage'])
+                chunk = self.nemo.fragments.path(self.nemo.fragment_key(nt, '1.1-1.20'))
+                self.assertEqual(self.nemo.fragments.prune(set(paths) - {chunk}), 1)
+                self.assertFalse(os.path.isfile(chunk))
+            finally:
+                self.nemo.fragments = None
+
+    def test_multipassage_threads(self):
+        """ Make sure that the passages of r_multipassage are rendered in threads and returned in the original order"""
+        ids = 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1+urn:cts:cjhnt:nt.86-Jud.grc001'
+        with self.client:
+            self.client.get('/')
+            with patch.object(self.nemo, 'passage_workers', 1):
+                expected = self.nemo.r_multipassage(ids, '145+1.2')
+            with patch.object(self.nemo.passage_executor, 'submit', wraps=self.nemo.passage_executor.submit) as mock_submit:
+                data = self.nemo.r_multipassage(ids, '145+1.2')
+                self.assertEqual(mock_submit.call_count, 2)
+            self.assertEqual([d['objectId'] for d in data['objects']], ids.split('+'))
+            self.assertEqual([(d['subreference'], d['text_passage']) for d in data['objects']],
+                             [(d['subreference'], d['text_passage']) for d in expected['objects']])
+            self.assertEqual(len(session['_flashes']), 2, 'The message of the missing reference should be flashed.')
+            # Before Flask 1.1, messages flashed in the copies of the request context were lost
+            with patch('formulae.nemo.flash') as mock_flash:
+                mock_flash.side_effect = lambda message: self.assertIs(threading.current_thread(),
+                                                                       threading.main_thread())
+                self.nemo.r_multipassage(ids, '145+1.2')
+                self.assertEqual(mock_flash.call_count, 1)
+
+    def test_versions(self):
+        """ Make sure that the versions shown next to a text are read from the index built at load time"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        com = 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1'
+        for objectId in [nt, 'urn:cts:cjhnt:nt.86-Jud', com]:
+            parent = self.nemo.resolver.getMetadata(self.nemo.resolver.getMetadata(objectId).parent.id)
+            self.assertEqual([(v.id, v.label, v.lang) for v in self.nemo.versions[objectId]],
+                             [(m.id, str(m.get_label()), m.lang) for m in parent.readableDescendants])
+        with self.client:
+            self.client.get('/')
+            with patch.object(self.nemo, 'make_version') as mock_version:
+                data = self.nemo.r_multipassage(nt + '+' + com, '1+1')
+                mock_version.assert_not_called()
+            self.assertEqual(data['translation'][nt], [v for v in self.nemo.versions[nt] if v.id not in [nt, com]])
+
+    def test_commentary_index(self):
+        """ Make sure that the NT-commentary relations are found by overlapping references in both directions and
+        reloaded when the appmeta database changes"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        com = 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1'
+        index = CommentaryIndex([(nt + ':1.1-1.20', com + ':1'), (nt + ':1.5', com + ':2'), (nt + ':2', com + ':3'),
+                                 (nt + ':1.21-1.25', com + ':4'), (nt + ':1.1-1.20', com + ':1')])
+        self.assertEqual(index.get_commentaries(nt + ':1.5'), [com + ':1', com + ':2'])
+        self.assertEqual(index.get_commentaries(nt + ':1.20-2.3'), [com + ':1', com + ':3', com + ':4'])
+        self.assertEqual(index.get_commentaries(nt + ':1'), [com + ':1', com + ':2', com + ':4'])
+        self.assertEqual(index.get_commentaries(nt + ':3.1'), [])
+        self.assertEqual(index.get_commentaries('urn:cts:cjhnt:nt.85-Jud.grc001:1.5'), [])
+        self.assertEqual(index.get_nt_passages(com + ':1-2'), [nt + ':1.1-1.20', nt + ':1.5'])
+        self.assertEqual(len(self.nemo.get_commentary_index()), 0)
+        db.session.add(NtComRels(nt=nt + ':1.1-1.20', com='urn:cts:greekLit:commentary.tlg0042006.opp-grc1:1'))
+        db.session.commit()
+        with self.client:
+            self.client.get('/')
+            data = self.nemo.r_commentary_view(nt, '1.5')
+            self.assertEqual([(d['objectId'], d['subreference']) for d in data['comm_sections']],
+                             [(com, '1')])
+            with patch.object(NtComRels, 'query') as mock_query:
+                self.nemo.r_commentary_view(nt, '1.5')
+                mock_query.with_entities.assert_not_called()
+
+    def test_commentary_view_threads(self):
+        """ Make sure that commentary sections are rendered concurrently with the parents of each commentary built once
+        and that the passages next to the NT passage are prefetched"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        com = 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1'
+        for ref in ['1', '2', '3']:
+            db.session.add(NtComRels(nt=nt + ':1.1-1.20', com=com + ':' + ref))
+        db.session.add(NtComRels(nt=nt + ':1.21', com=com + ':4'))
+        db.session.commit()
+        with self.client:
+            self.client.get('/')
+            with patch.object(self.nemo, 'passage_workers', 1):
+                expected = self.nemo.r_commentary_view(nt, '1.1-1.20')
+            self.nemo.passage_cache.clear()
+            with patch.object(self.nemo, 'make_parents', wraps=self.nemo.make_parents) as mock_parents:
+                data = self.nemo.r_commentary_view(nt, '1.1-1.20')
+                self.assertEqual(mock_parents.call_count, 2, 'The parents should be built for the NT and once for the commentary.')
+            self.assertEqual(data['nt']['template'], 'main::text.html')
+            self.assertEqual([(d['subreference'], d['text_passage'], d['collections']['parents']) for d in data['comm_sections']],
+                             [(d['subreference'], d['text_passage'], d['collections']['parents']) for d in expected['comm_sections']])
+            self.nemo.prefetch_commentaries = True
+            with patch.object(self.nemo, 'passage_workers', 1), \
+                    patch.object(self.nemo.passage_executor, 'submit') as mock_submit:
+                self.nemo.r_commentary_view(nt, '1.1-1.20')
+                mock_submit.assert_not_called()
+            self.nemo.prefetch_executor.shutdown(wait=True)
+            self.assertIsNotNone(self.nemo.passage_cache.get(self.nemo.passage_cache_key(nt, '1.21-1.25')))
+            self.assertIsNotNone(self.nemo.passage_cache.get(self.nemo.passage_cache_key(com, '4')))
+            with patch.object(self.nemo, 'get_passage') as mock_get_passage:
+                self.nemo.prefetch_commentary(nt, '1.21-1.25')
+                mock_get_passage.assert_not_called()
+            self.assertTrue(self.nemo.prefetch_slots.acquire(blocking=False))
+            self.assertTrue(self.nemo.prefetch_slots.acquire(blocking=False))
+            with patch.object(self.nemo, 'prefetch_executor') as mock_executor:
+                self.assertFalse(self.nemo.submit_prefetch(nt, '1.21-1.25'))
+                mock_executor.submit.assert_not_called()
+            self.nemo.prefetch_slots.release()
+            self.nemo.prefetch_slots.release()
+
+    def test_sibling_table(self):
+        """ Make sure that the previous and next passages are looked up in the sibling table of the text"""
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        table = self.nemo.get_sibling_table(nt)
+        self.assertIs(self.nemo.get_sibling_table(nt), table)
+        self.assertEqual(table.siblings('1.1-1.20'), (None, '1.21-1.25'))
+        self.assertEqual(table.siblings('1.5-1.7'), ('1.2-1.4', '1.8-1.10'))
+        self.assertEqual(table.siblings('1.2-1.4'), ('1.1', '1.5-1.7'))
+        self.assertEqual(table.siblings('1.24-1.25'), ('1.22-1.23', None))
+        self.assertEqual(table.siblings('1.24-1'), None)
+        for reff in ['1.1', '1.13', '1.25']:
+            self.assertEqual(table.siblings(reff), tuple(str(r) if r is not None else None for r in
+                                                         self.nemo.get_passage(nt, reff).siblingsId))
+        with self.client:
+            self.client.get('/')
+            with patch.object(Nemo, 'get_siblings') as mock_siblings, \
+                    patch.object(self.nemo, 'get_reffs') as mock_reffs:
+                data = self.nemo.r_passage(nt, '1.5')
+                self.assertEqual(self.nemo.get_first_passage(nt), '1.1-1.20')
+                mock_siblings.assert_not_called()
+                mock_reffs.assert_not_called()
+            self.assertEqual((data['prev'], data['next']), ('1.4', '1.6'))
+        self.nemo.resolver.text_version = lambda objectId: 'changed'
+        self.assertIsNot(self.nemo.get_sibling_table(nt), table, 'The table of a changed text should be built again.')
+        self.nemo.sibling_tables = BoundedMemoryCache(max_items=1)
+        self.nemo.get_sibling_table(nt)
+        self.nemo.get_sibling_table('urn:cts:greekLit:tlg0527.tlg039.1st1K-grc1')
+        self.assertEqual(len(self.nemo.sibling_tables), 1, 'The tables should be bounded.')
+        self.assertFalse(self.nemo.sibling_tables.has(nt))
+
+    def test_conditional_requests(self):
+        """ Make sure that unchanged pages are answered with 304 Not Modified before they are rendered"""
+        url = '/texts/urn:cts:cjhnt:nt.86-Jud.grc001+urn:cts:cjhnt:commentary.tlg0042006.opp-grc1/passage/1+1'
+        with self.client as c:
+            response = c.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+            with patch.object(self.nemo, 'r_multipassage') as mock_passage:
+                response = c.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.headers['ETag'], etag)
+                response = c.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertEqual(response.status_code, 304)
+                mock_passage.assert_not_called()
+            self.assertEqual(c.get(url, headers={'If-None-Match': '"other"'}).status_code, 200)
+            self.assertEqual(c.get('/texts/urn:cts:cjhnt:nt.86-Jud.grc001/passage/1',
+                                   headers={'If-None-Match': etag}).status_code, 200)
+            with patch.object(self.nemo, 'get_locale', return_value='en'):
+                self.assertNotEqual(c.get(url).headers['ETag'], etag, 'The ETag should depend on the locale.')
+            with patch.object(self.nemo.resolver, 'corpus_version', 'changed', create=True):
+                response = c.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200, 'A changed corpus should be rendered again.')
+            commentary_version = int((time() + 100) * 1e9)
+            with patch.object(self.nemo, 'commentary_index_version', return_value=commentary_version):
+                response = c.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200,
+                                 'Changed NT-commentary relations should be rendered again.')
+                self.assertEqual(self.nemo.commentary_index.version, commentary_version)
+                response = c.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertEqual(response.status_code, 200, 'The relations should be newer than the Last-Modified time.')
+            with patch.object(self.nemo, 'templates_version', int((time() + 200) * 1e9)):
+                self.assertEqual(c.get(url, headers={'If-Modified-Since': last_modified}).status_code, 200,
+                                 'Changed templates should be rendered again.')
+                last_modified = c.get(url).headers['Last-Modified']
+                self.assertEqual(c.get(url, headers={'If-Modified-Since': last_modified}).status_code, 304)
+                with c.session_transaction() as sess:
+                    sess['locale'] = 'de'
+                self.assertEqual(c.get(url, headers={'If-Modified-Since': last_modified}).status_code, 200,
+                                 'The Last-Modified time should not be used for the pages of a session.')
+            response = c.get(url.replace('1+1', '1+145'))
+            self.assertNotIn('ETag', response.headers, 'Pages with flashed messages should not be validated.')
+            self.assertNotIn('ETag', c.get('/').headers)
+
+    def test_cache_policies(self):
+        """ Make sure that the responses are cached according to the policies of their routes and that the shared cache
+        is asked to purge the pages of reloaded textgroups"""
+        url = '/texts/urn:cts:cjhnt:nt.86-Jud.grc001+urn:cts:cjhnt:commentary.tlg0042006.opp-grc1/passage/1+1'
+        self.app.config['CACHE_MAX_AGE'] = 3600
+        with self.client as c:
+            response = c.get(url)
+            self.assertEqual(response.cache_control.s_maxage, '3600')
+            self.assertTrue(response.cache_control.public)
+            self.assertIn('Cookie', response.vary)
+            self.assertEqual(response.headers['Surrogate-Key'].split(),
+                             ['urn:cts:cjhnt:commentary', 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1',
+                              'urn:cts:cjhnt:nt', 'urn:cts:cjhnt:nt.86-Jud.grc001'])
+            self.assertIn('collections', c.get('/collections/urn:cts:cjhnt:nt').headers['Surrogate-Key'].split())
+            response = c.get(url.replace('1+1', '1+145'))
+            self.assertTrue(response.cache_control.private, 'Pages with flashed messages should not be shared.')
+            self.assertNotIn('Surrogate-Key', response.headers)
+            self.assertTrue(c.get('/auth/login').cache_control.no_store)
+            self.assertEqual(c.get('/search/doc').cache_control.s_maxage, '3600')
+            response = c.get('/search/results')
+            self.assertIsNone(response.cache_control.s_maxage, 'Search results should not be shared.')
+            self.assertIn('Cookie', response.vary)
+            c.post('/auth/login', data=dict(username='project.member', password="some_password"))
+            response = c.get(url)
+            self.assertTrue(response.cache_control.private, 'The pages of logged-in users should not be shared.')
+            self.assertIsNone(response.cache_control.s_maxage)
+            with patch.object(login, '_load_user') as mock_load_user:
+                for asset in ['/assets/nemo/css/theme.css', '/static/bootstrap/css/bootstrap.min.css']:
+                    response = c.get(asset)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(response.cache_control.public, 'Static files should be shared with all users.')
+                    self.assertNotIn('Cookie', response.vary)
+                mock_load_user.assert_not_called()
+        with patch('formulae.nemo.purge_surrogate_keys') as mock_purge, \
+                patch.object(self.nemo.resolver, 'reload', return_value=['nt'], create=True), \
+                patch.object(self.nemo.resolver, 'reloaded_textgroups', ['urn:cts:cjhnt:nt'], create=True):
+            self.nemo.reload()
+            mock_purge.assert_not_called()
+            self.app.config['CACHE_PURGE_URL'] = 'http://localhost:6081/'
+            self.nemo.reload()
+            mock_purge.assert_called_once_with('http://localhost:6081/', ['urn:cts:cjhnt:nt', 'collections'])
+        self.app.config['CACHE_PURGE_URL'] = None
+
+    def test_fragment_cache(self):
+        """ Make sure that the {% cache %} blocks of the templates are rendered once for every corpus version, locale
+        and login state"""
+        cache = FragmentCache(lambda: 'v1', max_items=2)
+        caller = Mock(side_effect=['<a>', '<b>', '<c>'])
+        self.assertEqual(cache.render(0, 'menu', [], caller), '<a>')
+        self.assertEqual(cache.render(0, 'menu', [], caller), '<a>')
+        self.assertEqual(cache.render(0, 'menu', ['urn'], caller), '<b>')
+        cache.context_key = lambda: 'v2'
+        self.assertEqual(cache.render(0, 'menu', [], caller), '<c>')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        url = '/work/urn:cts:cjhnt:nt.86-Jud.grc001'
+        fragment_cache = self.app.jinja_env.fragment_cache
+        with self.client as c:
+            expected = c.get(url).data
+            misses = fragment_cache.stats()['misses']
+            self.assertEqual(c.get(url).data, expected)
+            self.assertEqual(fragment_cache.stats()['misses'], misses)
+            self.assertGreater(fragment_cache.stats()['saved'], 0)
+            self.app.jinja_env.fragment_cache = None
+            self.assertEqual(c.get(url).data, expected)
+            self.app.jinja_env.fragment_cache = fragment_cache
+            with c.session_transaction() as sess:
+                sess['locale'] = 'de'
+            self.assertIn('Kapitel 1'.encode('utf-8'), c.get(url).data)
+            self.assertGreater(fragment_cache.stats()['misses'], misses)
+        with patch.object(self.nemo.resolver, 'reload', return_value=['nt'], create=True):
+            self.nemo.reload()
+        self.assertEqual(fragment_cache.stats()['items'], 0, 'The fragments of the old corpus should be removed.')
+
     def test_NemoFormulae_f_replace_indexed_item(self):
         """ Make sure that the replace_indexed_item filter works correctly"""
         old_list = [1, 2, 3, 5, 5, 6, 7]
@@ -82,6 +577,235 @@ class TestFunctions(Formulae_Testing):
         self.assertEqual(test_list, new_list)
 
 
+class TestResolver(Formulae_Testing):
+    def test_reff_tree(self):
+        """ Make sure that the reference tree of a text is built in one traversal and cached by text version"""
+        resolver = FormulaeCTSResolver(self.app.config['CORPUS_FOLDERS'], dispatcher=organizer,
+                                       cache=BoundedMemoryCache())
+        nt = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        expected = [(reff, resolver.getReffs(nt, subreference=reff)) for reff in resolver.getReffs(nt)]
+        self.assertEqual(resolver.getReffTree(nt), expected)
+        self.assertEqual(resolver.getReffTree(nt, depth=1), resolver.getReffs(nt))
+        comm = 'urn:cts:cjhnt:commentary.tlg0042006.opp-grc1'
+        self.assertEqual(resolver.getReffTree(comm), resolver.getReffs(comm), 'A single level should be returned as is.')
+        with patch.object(resolver, 'getReffs') as mock_reffs, \
+                patch('formulae.resolver.reff_tree') as mock_tree:
+            self.assertEqual(resolver.getReffTree(nt), expected)
+            mock_reffs.assert_not_called()
+            mock_tree.assert_not_called()
+        resolver.text_version = lambda objectId: 'changed'
+        with patch('formulae.resolver.reff_tree', return_value=[]) as mock_tree:
+            resolver.getReffTree(nt)
+            mock_tree.assert_called_once()
+        self.nemo.resolver.cache.clear()
+        with patch.object(self.nemo.resolver, 'getReffs') as mock_reffs:
+            self.assertEqual(self.nemo.r_work(nt)['collections']['readable'], expected)
+            mock_reffs.assert_not_called()
+
+    def test_inventory_snapshot(self):
+        """ Make sure that the inventory snapshot is written once and then loaded instead of parsing the corpus"""
+        folders = self.app.config['CORPUS_FOLDERS']
+        with tempfile.TemporaryDirectory() as snapshot_folder:
+            resolver = FormulaeCTSResolver(folders, dispatcher=organizer, snapshot_folder=snapshot_folder)
+            expected = sorted([t.id for t in resolver.getMetadata().readableDescendants])
+            self.assertTrue(os.path.isfile(resolver.snapshot_path), 'The snapshot should have been saved.')
+            with patch.object(NautilusCTSResolver, 'parse') as mock_parse:
+                resolver = FormulaeCTSResolver(folders, dispatcher=organizer, snapshot_folder=snapshot_folder)
+                texts = sorted([t.id for t in resolver.getMetadata().readableDescendants])
+                mock_parse.assert_not_called()
+            self.assertEqual(texts, expected)
+            self.assertEqual(str(resolver.getMetadata('urn:cts:cjhnt:nt.86-Jud.grc001').citation.name), 'chapter')
+            self.assertIsNotNone(resolver.snapshot_time)
+
+    def test_inventory_snapshot_corpus_change(self):
+        """ Make sure that a changed corpus does not use the snapshot of its older version"""
+        folders = self.app.config['CORPUS_FOLDERS']
+        fingerprint = corpus_fingerprint(folders)
+        with tempfile.TemporaryDirectory() as snapshot_folder:
+            resolver = FormulaeCTSResolver(folders, dispatcher=organizer, snapshot_folder=snapshot_folder)
+            resolver.getMetadata()
+            old_path = resolver.snapshot_path
+            fingerprint['tests/test_data/cjhnt/data/nt'] = 'changed'
+            resolver = FormulaeCTSResolver(folders, dispatcher=organizer, snapshot_folder=snapshot_folder,
+                                           fingerprint=fingerprint)
+            self.assertNotEqual(resolver.corpus_version, corpus_version(corpus_fingerprint(folders)))
+            self.assertIsNone(resolver.load_snapshot())
+            resolver.getMetadata()
+            self.assertTrue(os.path.isfile(resolver.snapshot_path))
+            self.assertFalse(os.path.isfile(old_path), 'Outdated snapshots should be removed.')
+
+    def test_saved_fingerprint(self):
+        """ Make sure that only the textgroups whose files have changed are hashed again when the resolver starts"""
+        with tempfile.TemporaryDirectory() as folder:
+            corpus = os.path.join(folder, 'cjhnt')
+            shutil.copytree(self.app.config['CORPUS_FOLDERS'][0], corpus)
+            snapshot_folder = os.path.join(folder, 'snapshots')
+            resolver = FormulaeCTSResolver([corpus], dispatcher=build_organizer(), snapshot_folder=snapshot_folder)
+            self.assertEqual(resolver.fingerprint, corpus_fingerprint([corpus]))
+            self.assertTrue(os.path.isfile(resolver.fingerprint_path))
+            with patch('formulae.resolver.textgroup_digest') as mock_digest:
+                restarted = FormulaeCTSResolver([corpus], dispatcher=build_organizer(), snapshot_folder=snapshot_folder)
+                mock_digest.assert_not_called()
+            self.assertEqual(restarted.corpus_version, resolver.corpus_version)
+            cts = os.path.join(corpus, 'data', 'nt', '__cts__.xml')
+            with open(cts) as f:
+                xml = f.read()
+            with open(cts, 'w') as f:
+                f.write(xml.replace('Novum Testamentum Graece', 'Novum Testamentum'))
+            with patch('formulae.resolver.textgroup_digest', wraps=textgroup_digest) as mock_digest:
+                changed = FormulaeCTSResolver([corpus], dispatcher=build_organizer(), snapshot_folder=snapshot_folder)
+                mock_digest.assert_called_once_with(os.path.join(corpus, 'data', 'nt'))
+            self.assertEqual(changed.fingerprint, corpus_fingerprint([corpus]))
+            self.assertNotEqual(changed.corpus_version, resolver.corpus_version)
+
+    def describe_inventory(self, inventory):
+        # get_label() without a language returns whichever label the graph yields first, so all of them are compared
+        return sorted([(m.id, type(m).__name__, m.parent.id if m.parent else None,
+                        sorted(str(label) for label in m.graph.objects(m.asNode(), RDFS.label)),
+                        [(c.name, c.xpath, c.scope) for c in m.citation] if m.readable else None)
+                       for m in inventory.descendants])
+
+    def test_parallel_parsing(self):
+        """ Make sure that parsing the corpus in several processes builds the same inventory as the serial parsing"""
+        folders = self.app.config['CORPUS_FOLDERS']
+        expected = self.describe_inventory(NautilusCTSResolver(folders, dispatcher=build_organizer()).inventory)
+        serial = FormulaeCTSResolver(folders, dispatcher=build_organizer(), workers=1)
+        self.assertEqual(self.describe_inventory(serial.inventory), expected)
+        parallel = FormulaeCTSResolver(folders, dispatcher=build_organizer(), workers=2)
+        self.assertEqual(self.describe_inventory(parallel.inventory), expected)
+
+    def test_lazy_text_loading(self):
+        """ Make sure that TEI texts are only parsed when needed and that only a bounded number of them is kept"""
+        resolver = FormulaeCTSResolver(self.app.config['CORPUS_FOLDERS'], dispatcher=organizer, text_cache_items=1)
+        with patch.object(resolver, 'xmlparse', wraps=resolver.xmlparse) as mock_parse:
+            resolver.getMetadata()
+            mock_parse.assert_not_called()
+            resolver.getReffs('urn:cts:cjhnt:nt.86-Jud.grc001')
+            resolver.getTextualNode('urn:cts:cjhnt:nt.86-Jud.grc001', subreference='1.1')
+            self.assertEqual(mock_parse.call_count, 1, 'The text should only be parsed once.')
+            resolver.getReffs('urn:cts:greekLit:tlg0527.tlg039.1st1K-grc1')
+            self.assertEqual(len(resolver.texts_parsed), 1, 'Only the most recently used text should be kept.')
+            resolver.getReffs('urn:cts:cjhnt:nt.86-Jud.grc001')
+            self.assertEqual(mock_parse.call_count, 3)
+
+    def test_resolver_cache_namespace(self):
+        """ Make sure that the resolver cache is namespaced by the corpus version and answers repeated calls"""
+        with tempfile.TemporaryDirectory() as cache_folder:
+            cache = TwoTierCache(cache_folder, memory_items=10, disk_items=100)
+            os.makedirs(os.path.join(cache_folder, TwoTierCache.NAMESPACE_PREFIX + 'old_version'))
+            resolver = FormulaeCTSResolver(self.app.config['CORPUS_FOLDERS'], dispatcher=organizer, cache=cache)
+            self.assertEqual(cache.namespace, resolver.corpus_version)
+            current = TwoTierCache.NAMESPACE_PREFIX + resolver.corpus_version
+            self.assertEqual(sorted(os.listdir(cache_folder)), sorted([current, TwoTierCache.NAMESPACE_PREFIX + 'old_version']),
+                             'The entries of older corpus versions should be kept for the workers still serving them.')
+            self.assertEqual(cache.prune(max_age=3600), [], 'Recently used folders should be kept.')
+            self.assertEqual(cache.prune(), [TwoTierCache.NAMESPACE_PREFIX + 'old_version'])
+            self.assertEqual(os.listdir(cache_folder), [current])
+            reffs = resolver.getReffs('urn:cts:cjhnt:nt.86-Jud.grc001', level=2)
+            with patch.object(NautilusCTSResolver, '__getText__') as mock_get_text:
+                self.assertEqual(resolver.getReffs('urn:cts:cjhnt:nt.86-Jud.grc001', level=2), reffs)
+                cache.memory.clear()
+                self.assertEqual(resolver.getReffs('urn:cts:cjhnt:nt.86-Jud.grc001', level=2), reffs)
+                mock_get_text.assert_not_called()
+
+
+    def test_reload(self):
+        """ Make sure that only the textgroups that have changed are re-parsed and invalidated"""
+        nt_text = 'urn:cts:cjhnt:nt.86-Jud.grc001'
+        other_text = 'urn:cts:greekLit:tlg0527.tlg039.1st1K-grc1'
+        with tempfile.TemporaryDirectory() as folder:
+            corpus = os.path.join(folder, 'cjhnt')
+            shutil.copytree(self.app.config['CORPUS_FOLDERS'][0], corpus)
+            resolver = FormulaeCTSResolver([corpus], dispatcher=build_organizer())
+            expected = self.describe_inventory(resolver.inventory)
+            self.assertEqual(resolver.reload(), [])
+            resolver.getReffs(other_text)
+            other_version = resolver.text_version(other_text)
+            nt_version = resolver.text_version(nt_text)
+            cts = os.path.join(corpus, 'data', 'nt', '__cts__.xml')
+            with open(cts) as f:
+                xml = f.read()
+            with open(cts, 'w') as f:
+                f.write(xml.replace('Novum Testamentum Graece', 'Novum Testamentum'))
+            with patch.object(resolver, 'parse_textgroup', wraps=resolver.parse_textgroup) as mock_parse:
+                self.assertEqual(resolver.reload(), [os.path.join(corpus, 'data', 'nt')])
+                mock_parse.assert_called_once_with(cts)
+            self.assertEqual(resolver.reloaded_textgroups, ['urn:cts:cjhnt:nt'])
+            self.assertEqual(str(resolver.getMetadata('urn:cts:cjhnt:nt').get_label()), 'Novum Testamentum')
+            self.assertNotEqual(resolver.text_version(nt_text), nt_version)
+            self.assertEqual(resolver.text_version(other_text), other_version)
+            self.assertEqual(len(resolver.texts_parsed), 1, 'Unchanged texts should stay parsed.')
+            self.assertEqual([x for x in self.describe_inventory(resolver.inventory) if x[0] != 'urn:cts:cjhnt:nt'],
+                             [x for x in expected if x[0] != 'urn:cts:cjhnt:nt'])
+            self.assertEqual(resolver.getReffs(nt_text)[0], '1')
+
+    def test_reload_trigger(self):
+        """ Make sure that the workers reload the corpus in the background when the reload trigger is touched and that a
+        trigger touched during a reload is not lost"""
+        with tempfile.TemporaryDirectory() as snapshot_folder, \
+                patch.object(self.nemo.resolver, 'reload', return_value=[], create=True) as mock_reload:
+            self.nemo.resolver.snapshot_folder = snapshot_folder
+            self.client.get('/')
+            self.assertIsNone(self.nemo.reload_thread)
+            with open(self.nemo.resolver.reload_trigger, 'w'):
+                pass
+            os.utime(self.nemo.resolver.reload_trigger, (time() + 1, time() + 1))
+            self.client.get('/')
+            self.nemo.reload_thread.join()
+            self.client.get('/')
+            self.nemo.reload_thread.join()
+            mock_reload.assert_called_once_with()
+            with self.nemo.reload_lock:
+                os.utime(self.nemo.resolver.reload_trigger, (time() + 2, time() + 2))
+                self.client.get('/')
+                self.assertEqual(mock_reload.call_count, 1)
+            self.client.get('/')
+            self.nemo.reload_thread.join()
+            self.assertEqual(mock_reload.call_count, 2, 'A trigger touched during a reload should be handled later.')
+            self.nemo.resolver.snapshot_folder = None
+
+
+class TestCache(TestCase):
+    def test_memory_cache_lru(self):
+        """ Make sure that the memory tier evicts the least recently used entry"""
+        cache = BoundedMemoryCache(max_items=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([cache.get(k) for k in 'abc'], [1, None, 3])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_memory_cache_fifo(self):
+        """ Make sure that the fifo policy evicts the oldest entry even if it was used recently"""
+        cache = BoundedMemoryCache(max_items=2, policy='fifo')
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([cache.get(k) for k in 'abc'], [None, 2, 3])
+
+    def test_memory_cache_max_size(self):
+        """ Make sure that the memory tier respects its maximum size"""
+        cache = BoundedMemoryCache(max_items=0, max_size=10, sizeof=len)
+        cache.set('a', 'x' * 6)
+        cache.set('b', 'x' * 6)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 6)
+
+    def test_two_tier_cache(self):
+        """ Make sure that entries evicted from memory are served and promoted from the disk tier"""
+        with tempfile.TemporaryDirectory() as cache_folder:
+            cache = TwoTierCache(cache_folder, namespace='v1', memory_items=1, disk_items=10)
+            cache.set('a', [1])
+            cache.set('b', [2])
+            self.assertIsNone(cache.memory.get('a'))
+            self.assertEqual(cache.get('a'), [1])
+            self.assertEqual(cache.memory.get('a'), [1])
+            cache.namespace = 'v2'
+            self.assertIsNone(cache.get('a'), 'Entries of another namespace should never be served.')
+
+
 class TestIndividualRoutes(Formulae_Testing):
     def test_anonymous_user(self):
         """ Make sure that protected routes do not work with unauthorized users and that unprotected routes do
@@ -276,6 +1000,21 @@ class TestIndividualRoutes(Formulae_Testing):
         result = self.nemo.highlight_found_sents(html_input, search_string)
         self.assertIn(expected, result)
 
+    def test_search_result_highlighting_matches(self):
+        """ Make sure that all sentences are found in one pass and that overlapping sentences and punctuation-only
+        words are highlighted correctly"""
+        matcher = SentenceMatcher([['b', 'c'], ['a', 'b', 'c', 'd'], ['c'], ['x'], ['b', 'c']])
+        self.assertEqual(matcher.find(['a', 'b', 'c', 'b', 'c', 'd', 'a', 'b', 'c', 'd']),
+                         {0: (1, 2), 2: (2, 2), 4: (1, 2), 1: (6, 9)})
+        html = '<div><p><span class="w">Text</span> <span class="w">,</span> <span class="w">that</span> ' \
+               '<span class="w">I</span></p><p><span class="w">want</span></p></div>'
+        result = self.nemo.highlight_found_sents(html, ['that I want', 'I', 'that I want'])
+        self.assertEqual(result, '<div><p><span class="w">Text</span> <span class="w">,</span> '
+                                 '<span class="searched"><span class="w searched-start">that</span> '
+                                 '<span class="w searched-start searched-end">I</span></span></p><p>'
+                                 '<span class="searched"><span class="w searched-start searched-end">want</span></span>'
+                                 '</p></div>')
+
     def test_convert_result_sents(self):
         """ Make sure that search result_sents are converted correctly"""
         input_str = 'Anno+XXV+pos+<%2Fsmall><strong>regnum<%2Fstrong><small>+domni+nistri+Lodoici+regis+in%24Notavimus+die+et+<%2Fsmall><strong>regnum<%2Fstrong><small>%2C+superscripsi.+Signum+Petrone'